@@ -69,16 +69,70 @@ PROGRAM_MANPAGE = {
         -r, --repeat    Repeat songs.
         -s, --shuffle   Shuffle songs.  If combined with repeat, the songs will be
                         shuffled before each repeat.
+        -m <mode>, --shuffle-mode <mode>
+                        How songs are shuffled, implies --shuffle.  Choose
+                        from *songs* (each song is placed independently),
+                        *artist* (the songs of each artist are spread evenly,
+                        so an artist is rarely heard twice in a row), *album*
+                        (whole albums are played, in random order) or
+                        *weighted* (songs that have been played less often
+                        tend to come first).  The default is *songs*.
+        --seed <seed>   Seed used when shuffling, so a shuffled session can be
+                        reproduced.  By default a seed is chosen at random and
+                        saved in the restart file, so a restarted session
+                        continues in the same order.
+        -g, --gapless   Start each song as the previous one ends, without a gap.
+                        Useful for live albums and mixes.
+        --stream        Start playing as soon as the first song is found rather
+                        than waiting until all songs have been found.  Useful
+                        with large libraries on slow storage.  When shuffling,
+                        the first pass picks each song at random from those
+                        found so far, so its order cannot be reproduced with
+                        --seed.  Ignored with shuffle modes other than songs,
+                        as they need all the songs.
+        -q <query>, --query <query>
+                        Play the songs whose metadata matches the query.  The
+                        query is a sequence of terms, all of which must match.
+                        *field:value* matches if the field contains the value,
+                        *field:~regex* if it matches the regular expression,
+                        and *field:=value*, *field:>value*, *field:>=value*,
+                        *field:<value* and *field:<=value* compare the field
+                        to the value.  A term without a field matches the
+                        artist, album or title.  The fields are artist, album,
+                        title, track, volume, year, duration and gain (the
+                        ReplayGain in dB).  Only songs whose metadata is cached
+                        are found.
         -p <filename.m3u>, --playlist <filename.m3u>
                         Generate a playlist from the music specified rather than play
                         the music.
+        -x, --extended  Generate an extended playlist, which includes the
+                        duration and title of those songs whose metadata is
+                        cached.
+        -i, --index     Read the metadata of the songs and save it in the
+                        metadata cache rather than play them.  The songs are
+                        read by a pool of processes, one per core.  Songs
+                        whose metadata is already cached are skipped, so an
+                        interrupted run can be restarted.  The ReplayGain of
+                        songs that do not have it in their tags is computed
+                        from their audio if NumPy is installed, and is used
+                        to adjust the volume of each song as it is played.
+        -d, --daemon    Keep running once the songs have been played, accepting
+                        commands from other invocations of ``mp``.
+        -c <command>, --control <command>
+                        Send a command to the running daemon rather than play
+                        the music.  The command is one of *enqueue*, *skip*,
+                        *pause*, *resume*, *status* or *quit*.  The songs given
+                        are enqueued.
 
         If invoked with no arguments or options ``mp`` will repeat the session that was 
         previously run in the same directory, skipping any songs that had already been 
         played.
 
         The artist and title of the currently playing song is available from 
-        ~/.nowplaying.
+        ~/.nowplaying.  The file is replaced atomically, so it is never seen 
+        half written.  A JSON record of the song, including its position and 
+        duration, can also be published to a named pipe or a memory-mapped file 
+        by setting *now_playing_fifo* or *now_playing_record* in prefs.py.
 
         If you would like to be able to control the music player from the 
         keyboard without direct access to the program, consider binding keys to 
@@ -1,5 +1,6 @@
+from .journal import RestartJournal, read_restart_file
 from .metadata import MetaData
-from .player import Player
+from .player import Player, load_gstreamer
 from .prefs import *
 
 __version__ = "1.7.0"
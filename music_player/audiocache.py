@@ -0,0 +1,221 @@
+# AudioCache class
+#
+# Optionally keeps local copies of songs, so those that are played again, on
+# a repeat or in a later session, are played from local storage rather than
+# being read again from slow or network storage.  Songs are copied as their
+# metadata is prefetched, while the song before them plays, and the copy is
+# played in place of the original whenever it is current.  The copies are
+# limited to a budget of bytes, and once it is reached the least recently
+# played copies are discarded.  The songs are kept as they are rather than
+# decoded, as decoding is cheap compared to reading, and decoded audio is
+# roughly ten times larger.  Recently played copies generally remain in the
+# page cache, so they are often read from memory.
+#
+# The copies are listed, along with the size and modification time of the
+# original and when they were last played, in an index held alongside them.
+# A copy is only used if the original is unchanged, which requires the
+# original be stat'ed but not read.
+
+# Imports {{{1
+from .cache import Cache
+from inform import log, os_error, warn
+from hashlib import sha1
+from time import time
+import os
+import sqlite3
+
+# Globals {{{1
+copy_block_size = 1 << 20
+
+# AudioCache class {{{1
+class AudioCache(Cache):
+    name = 'audio cache'
+    version = 1
+    tables = dict(
+        songs = 'path text primary key, size integer, mtime integer, '
+                'used real',
+    )
+    indices = dict(
+        songs_used = 'songs (used)',
+    )
+
+    def __init__(self, directory, budget):
+        super().__init__(directory / 'index.db')
+        self.directory = directory
+        self.budget = budget
+        self.hits = self.misses = self.stored = self.evicted = 0
+        self.stopped = False
+            # set by stop() to abandon copies in progress
+        self.total = 0
+            # the total size of the copies
+        if self.connection:
+            with self.lock:
+                try:
+                    self.total = self.connection.execute(
+                        'select coalesce(sum(size), 0) from songs'
+                    ).fetchone()[0]
+                except sqlite3.Error as e:
+                    self._disable(e)
+
+    # lookup() {{{2
+    def lookup(self, song):
+        # returns the path of the copy of the song if there is a current one,
+        # otherwise None; it is then counted as a hit or a miss
+        path, stamp = self._stamp(song)
+        copy = self._copy_path(path)
+        with self.lock:
+            if stamp and self._find(path) == stamp and copy.exists():
+                try:
+                    self.connection.execute(
+                        'update songs set used = ? where path = ?',
+                        (time(), path)
+                    )
+                    self.connection.commit()
+                except sqlite3.Error as e:
+                    self._disable(e)
+                    return None
+                self.hits += 1
+                return copy
+            self.misses += 1
+        return None
+
+    # fetch() {{{2
+    def fetch(self, song):
+        # copies the song into the cache unless a current copy already exists
+        path, stamp = self._stamp(song)
+        if not stamp or stamp[0] > self.budget:
+            return
+        with self.lock:
+            if self._find(path) == stamp:
+                return
+        copy = self._copy_path(path)
+        temp = copy.with_name(copy.name + '.new')
+        try:
+            if not self._copy(path, temp):
+                temp.unlink()
+                return
+        except OSError as e:
+            warn(os_error(e))
+            return
+        with self.lock:
+            if not self.connection:
+                return
+            try:
+                replaced = self._find(path)
+                    # an out of date copy of the same song, which is replaced
+                    # by the new copy so its space is reused
+                self._evict(stamp[0] - (replaced[0] if replaced else 0), path)
+                temp.replace(copy)
+                self.connection.execute(
+                    'insert or replace into songs (path, size, mtime, used) '
+                    'values (?, ?, ?, ?)',
+                    (path,) + stamp + (time(),)
+                )
+                self.connection.commit()
+                self.total += stamp[0] - (replaced[0] if replaced else 0)
+                self.stored += 1
+            except OSError as e:
+                warn(os_error(e))
+            except sqlite3.Error as e:
+                self._disable(e)
+
+    # stop() {{{2
+    def stop(self):
+        # abandons any copies in progress, so exiting need not wait for them
+        self.stopped = True
+
+    # statistics() {{{2
+    def statistics(self):
+        lookups = self.hits + self.misses
+        return dict(
+            hits = self.hits,
+            misses = self.misses,
+            hit_rate = self.hits / lookups if lookups else None,
+            stored = self.stored,
+            evicted = self.evicted,
+            bytes = self.total,
+            budget = self.budget,
+        )
+
+    # close() {{{2
+    def close(self):
+        stats = self.statistics()
+        log('audio cache:', ', '.join(f'{k} = {v}' for k, v in stats.items()))
+        super().close()
+
+    # _stamp() (private) {{{2
+    def _stamp(self, song):
+        # returns the absolute path of the song along with its size and
+        # modification time, which are None if the song cannot be accessed or
+        # the cache is unavailable
+        path = os.path.abspath(song)
+        if not self.connection:
+            return path, None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return path, None
+        return path, (stat.st_size, stat.st_mtime_ns)
+
+    # _copy() (private) {{{2
+    def _copy(self, path, temp):
+        # copies the song a block at a time so the copy can be abandoned,
+        # returns False if it was
+        with open(path, 'rb') as source, open(temp, 'wb') as destination:
+            while not self.stopped:
+                block = source.read(copy_block_size)
+                if not block:
+                    return True
+                destination.write(block)
+        return False
+
+    # _copy_path() (private) {{{2
+    def _copy_path(self, path):
+        # the name of the copy is derived from the path of the original, the
+        # extension is retained as it may help GStreamer find its type
+        name = sha1(os.fsencode(path)).hexdigest()
+        return self.directory / (name + os.path.splitext(path)[1].lower())
+
+    # _find() (private) {{{2
+    def _find(self, path):
+        # returns the size and modification time of the original when it was
+        # copied, or None if there is no copy; must be called with lock held
+        if not self.connection:
+            return None
+        try:
+            row = self.connection.execute(
+                'select size, mtime from songs where path = ?', (path,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            self._disable(e)
+            return None
+        return tuple(row) if row else None
+
+    # _evict() (private) {{{2
+    def _evict(self, needed, keep):
+        # discards the least recently used copies, other than that of keep,
+        # until there is room for needed bytes; must be called with lock held
+        while self.total + needed > self.budget:
+            rows = self.connection.execute(
+                'select path, size from songs where path != ? '
+                'order by used limit 16',
+                (keep,)
+            ).fetchall()
+            if not rows:
+                # only the copy being replaced remains, if any
+                self.total = self.connection.execute(
+                    'select coalesce(sum(size), 0) from songs'
+                ).fetchone()[0]
+                return
+            for path, size in rows:
+                try:
+                    self._copy_path(path).unlink()
+                except FileNotFoundError:
+                    pass
+                self.connection.execute(
+                    'delete from songs where path = ?', (path,)
+                )
+                self.total -= size
+                self.evicted += 1
+                if self.total + needed <= self.budget:
+                    break
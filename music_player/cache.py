@@ -0,0 +1,252 @@
+# Caches
+#
+# Persistent on-disk caches held in SQLite databases.  The caches are
+# disposable: if one is out-of-date or cannot be opened it is simply discarded
+# or ignored.
+#
+# MetaDataCache holds music file metadata.  Entries are keyed on the path of
+# the music file along with its size and modification time, so a cached entry
+# is ignored and replaced as soon as the file changes.  The cache also serves
+# as the index searched by metadata queries, see query.py.
+#
+# PlayHistory holds the number of times each song has been played, which is
+# used when shuffling.
+
+# Imports {{{1
+from inform import Error, warn
+from functools import lru_cache
+from threading import Lock
+from time import time
+import os
+import re
+import sqlite3
+
+# Globals {{{1
+fields = 'artist album title track volume year duration gain'.split()
+
+# Cache base class {{{1
+class Cache(object):
+    # subclasses provide name, version and the table and index definitions
+    name = None
+    version = 1
+    tables = {}
+    indices = {}
+
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        self.lock = Lock()
+        self.connection = None
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(
+                str(cache_path), check_same_thread=False
+            )
+            version = connection.execute('pragma user_version').fetchone()[0]
+            if version != self.version:
+                # discard out-of-date caches
+                for table in self.tables:
+                    connection.execute(f'drop table if exists {table}')
+                connection.execute(f'pragma user_version = {self.version}')
+            for table, columns in self.tables.items():
+                connection.execute(
+                    f'create table if not exists {table} ({columns})'
+                )
+            for index, columns in self.indices.items():
+                connection.execute(
+                    f'create index if not exists {index} on {columns}'
+                )
+            connection.commit()
+            self.connection = connection
+        except (OSError, sqlite3.Error) as e:
+            warn(f'{self.name} is unavailable:', e, culprit=cache_path)
+
+    # close() {{{2
+    def close(self):
+        if self.connection:
+            with self.lock:
+                self.connection.close()
+                self.connection = None
+
+    # _disable() (private) {{{2
+    def _disable(self, e):
+        # must be called with lock held
+        warn(f'{self.name} is unavailable:', e, culprit=self.cache_path)
+        try:
+            self.connection.close()
+        except sqlite3.Error:
+            pass
+        self.connection = None
+
+# MetaDataCache class {{{1
+class MetaDataCache(Cache):
+    name = 'metadata cache'
+    version = 4
+    tables = dict(
+        metadata = 'path text primary key, size integer, mtime integer, '
+                   + ', '.join(fields),
+    )
+    indices = dict(
+        metadata_artist = 'metadata (artist collate nocase)',
+        metadata_album = 'metadata (album collate nocase)',
+        metadata_year = 'metadata (year)',
+    )
+
+    def __init__(self, cache_path):
+        super().__init__(cache_path)
+        if self.connection:
+            self.connection.create_function(
+                'regexp', 2, regexp, deterministic=True
+            )
+
+    # lookup() {{{2
+    def lookup(self, media_path):
+        # returns the key of the music file along with its cached metadata
+        # fields; the fields are None if the file is not in the cache or if the
+        # cached entry is stale.  The key is None if the file cannot be
+        # accessed, in which case it should not be cached.
+        if not self.connection:
+            return None, None
+        path = os.path.abspath(media_path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None, None
+        key = (path, stat.st_size, stat.st_mtime_ns)
+        with self.lock:
+            try:
+                row = self.connection.execute(
+                    f'select size, mtime, {", ".join(fields)} '
+                    'from metadata where path = ?',
+                    (path,)
+                ).fetchone()
+            except sqlite3.Error as e:
+                self._disable(e)
+                return None, None
+        if row and tuple(row[:2]) == key[1:]:
+            return key, dict(zip(fields, row[2:]))
+        return key, None
+
+    # store() {{{2
+    def store(self, key, values):
+        if key:
+            self.store_many([(key, values)])
+
+    # store_many() {{{2
+    def store_many(self, entries):
+        # stores a sequence of (key, values) pairs in a single transaction
+        if not self.connection or not entries:
+            return
+        with self.lock:
+            try:
+                self.connection.executemany(
+                    f'insert or replace into metadata '
+                    f'(path, size, mtime, {", ".join(fields)}) '
+                    f'values ({", ".join("?" * (len(fields) + 3))})',
+                    [
+                        key + tuple(values.get(f) for f in fields)
+                        for key, values in entries
+                    ]
+                )
+                self.connection.commit()
+            except sqlite3.Error as e:
+                self._disable(e)
+
+    # stamps() {{{2
+    def stamps(self):
+        # returns a dictionary that maps the path of each cached song to the
+        # size and modification time it had when its metadata was read
+        if not self.connection:
+            return {}
+        with self.lock:
+            try:
+                return {
+                    path: (size, mtime)
+                    for path, size, mtime in self.connection.execute(
+                        'select path, size, mtime from metadata'
+                    )
+                }
+            except sqlite3.Error as e:
+                self._disable(e)
+                return {}
+
+    # select() {{{2
+    def select(self, condition, params=()):
+        # returns the paths of the songs whose metadata satisfies the SQL
+        # condition, in order
+        if not self.connection:
+            raise Error(f'{self.name} is unavailable.')
+        with self.lock:
+            try:
+                rows = self.connection.execute(
+                    f'select path from metadata where {condition} '
+                    'order by path',
+                    params
+                ).fetchall()
+            except sqlite3.Error as e:
+                raise Error(e)
+        return [row[0] for row in rows]
+
+    # values() {{{2
+    def values(self, field):
+        # returns a dictionary that maps the path of each cached song to the
+        # value of the given field, entries that may be stale are included
+        if not self.connection:
+            return {}
+        with self.lock:
+            try:
+                return dict(self.connection.execute(
+                    f'select path, {field} from metadata '
+                    f'where {field} is not null'
+                ))
+            except sqlite3.Error as e:
+                self._disable(e)
+                return {}
+
+# PlayHistory class {{{1
+class PlayHistory(Cache):
+    name = 'play history'
+    version = 1
+    tables = dict(
+        plays = 'path text primary key, count integer, last integer',
+    )
+
+    # record() {{{2
+    def record(self, media_path):
+        if not self.connection:
+            return
+        path = os.path.abspath(media_path)
+        with self.lock:
+            try:
+                self.connection.execute(
+                    'insert into plays (path, count, last) values (?, 1, ?) '
+                    'on conflict (path) do update '
+                    'set count = count + 1, last = excluded.last',
+                    (path, int(time()))
+                )
+                self.connection.commit()
+            except sqlite3.Error as e:
+                self._disable(e)
+
+    # counts() {{{2
+    def counts(self):
+        # returns a dictionary that maps the path of each song played to the
+        # number of times it has been played
+        if not self.connection:
+            return {}
+        with self.lock:
+            try:
+                return dict(
+                    self.connection.execute('select path, count from plays')
+                )
+            except sqlite3.Error as e:
+                self._disable(e)
+                return {}
+
+# regexp() {{{1
+# Implements the SQL regexp operator, which SQLite leaves to the application.
+@lru_cache(maxsize=32)
+def _compile(pattern):
+    return re.compile(pattern, re.IGNORECASE)
+
+def regexp(pattern, value):
+    return value is not None and _compile(pattern).search(value) is not None
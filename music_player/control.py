@@ -0,0 +1,166 @@
+# Control
+#
+# Allows an mp daemon to be controlled by other invocations of mp.  The daemon
+# listens on a Unix domain socket that is watched from its main loop, so
+# commands are processed between bus messages and no extra thread is needed.
+# Each client connects, sends a single request as a line of JSON, closes its
+# side of the connection, and then reads a single reply in the same form.
+
+# Imports {{{1
+from .prefs import control_timeout, summary_sep
+from .player import load_gstreamer
+from inform import Error, os_error, warn
+import json
+import os
+import socket
+
+# Globals {{{1
+commands = 'enqueue skip pause resume status quit'.split()
+
+# ControlServer class {{{1
+class ControlServer(object):
+    def __init__(self, player, path, quit):
+        self.player = player
+        self.path = path
+        self.quit = quit
+        self.socket = None
+        self.watch = None
+
+        # refuse to start if another daemon is listening, otherwise remove the
+        # socket left behind by one that was killed
+        if path.is_socket():
+            if _is_listening(path):
+                raise Error('mp daemon is already running.', culprit=path)
+            path.unlink()
+
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.bind(str(path))
+            self.socket.listen()
+        except OSError as e:
+            raise Error(os_error(e))
+        GLib, Gst = load_gstreamer()
+        self.watch = GLib.io_add_watch(
+            self.socket.fileno(), GLib.PRIORITY_DEFAULT, GLib.IO_IN,
+            self._accept
+        )
+
+    # close() {{{2
+    def close(self):
+        if self.watch:
+            GLib, Gst = load_gstreamer()
+            GLib.source_remove(self.watch)
+            self.watch = None
+        if self.socket:
+            self.socket.close()
+            self.socket = None
+            try:
+                self.path.unlink()
+            except OSError:
+                pass
+
+    # _accept() (private) {{{2
+    def _accept(self, fd, condition):
+        # called from the main loop when a client connects
+        try:
+            connection, address = self.socket.accept()
+        except OSError as e:
+            warn(os_error(e))
+            return True
+        with connection:
+            connection.settimeout(control_timeout)
+                # a slow or stalled client must not hold up the player
+            try:
+                reply = self._process(json.loads(_receive(connection)))
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                reply = dict(error=f'invalid request: {e}')
+            except Error as e:
+                reply = dict(error=str(e))
+            try:
+                connection.sendall(json.dumps(reply).encode() + b'\n')
+            except OSError:
+                pass
+        return True
+
+    # _process() (private) {{{2
+    def _process(self, request):
+        # the request comes from another process, so its form is checked
+        if not isinstance(request, dict):
+            raise TypeError('expected an object')
+        command = request.get('command')
+        player = self.player
+        if command == 'enqueue':
+            songs = request.get('songs', [])
+            cwd = request.get('cwd', '/')
+            if not isinstance(songs, list) or not all(
+                isinstance(song, str) for song in songs
+            ):
+                raise TypeError('songs must be a list of paths')
+            if not isinstance(cwd, str):
+                raise TypeError('cwd must be a path')
+            count = player.enqueue(songs, cwd)
+            return dict(message=f'{count} songs enqueued.')
+        if command == 'skip':
+            player.skip()
+        elif command == 'pause':
+            player.pause()
+        elif command == 'resume':
+            player.resume()
+        elif command == 'quit':
+            self.quit()
+            return dict(message='quitting.')
+        elif command != 'status':
+            return dict(error=f'{command}: unknown command.')
+        status = player.status()
+        return dict(status, message=_summarize(status))
+
+# send_command() {{{1
+def send_command(path, command, songs=()):
+    # sends a command to the daemon and returns its reply
+    request = dict(command=command, songs=list(songs), cwd=os.getcwd())
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.connect(str(path))
+            connection.sendall(json.dumps(request).encode() + b'\n')
+            connection.shutdown(socket.SHUT_WR)
+            reply = _receive(connection)
+    except (FileNotFoundError, ConnectionRefusedError):
+        raise Error('mp daemon is not running.')
+    except OSError as e:
+        raise Error(os_error(e))
+    try:
+        reply = json.loads(reply)
+    except ValueError:
+        raise Error('invalid reply from mp daemon.')
+    if 'error' in reply:
+        raise Error(reply['error'])
+    return reply
+
+# _is_listening() (private) {{{1
+def _is_listening(path):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        try:
+            connection.connect(str(path))
+            return True
+        except OSError:
+            return False
+
+# _receive() (private) {{{1
+def _receive(connection):
+    # reads until the other side closes its end of the connection
+    chunks = []
+    while True:
+        chunk = connection.recv(65536)
+        if not chunk:
+            return b''.join(chunks).decode()
+        chunks.append(chunk)
+
+# _summarize() (private) {{{1
+def _summarize(status):
+    if status['state'] == 'idle':
+        return f"idle, {status['songs']} songs."
+    title = status['title'] or os.path.basename(status['song'])
+    if status['artist']:
+        title = f"{title} {summary_sep} {status['artist']}"
+    return f"{status['state']}: {title} ({status['played']} of {status['songs']})."
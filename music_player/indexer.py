@@ -0,0 +1,166 @@
+# Indexer
+#
+# Reads the metadata of many songs ahead of time and saves it in the metadata
+# cache, so it is available to queries, extended playlists and shuffling
+# without opening the songs.  Parsing the tags is CPU bound, so the songs are
+# read in batches by a pool of processes, one per core by default, and the
+# results are stored as each batch completes.  Only a few batches are
+# outstanding at any time, so memory use does not grow with the size of the
+# library.
+#
+# Songs that do not carry their ReplayGain in their tags have it computed from
+# their audio, see loudness.py, so it can be applied when they are played
+# without any analysis at that time.
+#
+# Songs whose cached metadata is current are skipped, so an interrupted run
+# can simply be restarted and continues where it left off.
+
+# Imports {{{1
+from .cache import fields
+from .loudness import measure_gain
+from .metadata import MetaData
+from .prefs import index_processes, index_batch_size, compute_replay_gain
+from .timing import timer
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from inform import Error, display, warn
+from multiprocessing import get_context
+from pathlib import Path
+from time import monotonic
+import os
+
+# Globals {{{1
+progress_interval = 2
+    # seconds between progress reports
+
+# index_songs() {{{1
+def index_songs(songs, cache):
+    # returns the number of songs read and the number already in the cache
+    stale, current = _find_stale(songs, cache)
+    total = len(stale)
+    if not total:
+        return 0, current
+    processes = index_processes or os.cpu_count() or 1
+    analyze = compute_replay_gain and _numpy_available()
+    decode = analyze and _gstreamer_available()
+    batches = (
+        stale[i:i + index_batch_size]
+        for i in range(0, total, index_batch_size)
+    )
+    done = 0
+    started = last_report = monotonic()
+    # the processes are forked, as mp is a script that cannot be re-imported
+    # as the main module by processes that are spawned
+    with ProcessPoolExecutor(
+        max_workers = processes,
+        mp_context = get_context('fork'),
+        initializer = _start_worker,
+    ) as pool:
+        pending = set()
+        batch = next(batches, None)
+        while batch or pending:
+            if batch and len(pending) < 2 * processes:
+                pending.add(pool.submit(_read_batch, batch, analyze, decode))
+                batch = next(batches, None)
+                continue
+            done += _store_completed(pending, cache)
+            if monotonic() - last_report >= progress_interval:
+                last_report = monotonic()
+                _report(done, total, last_report - started)
+    return done, current
+
+# _find_stale() (private) {{{1
+def _find_stale(songs, cache):
+    # returns the keys of the songs whose metadata is not cached or is out of
+    # date, along with the number that are current; a song reached through
+    # several playlists or directories is only counted and read once
+    stamps = cache.stamps()
+    stale = []
+    current = 0
+    for path in dict.fromkeys(os.path.abspath(song) for song in songs):
+        try:
+            stat = os.stat(path)
+        except OSError as e:
+            warn(e.strerror, culprit=path)
+            continue
+        stamp = (stat.st_size, stat.st_mtime_ns)
+        if stamps.get(path) == stamp:
+            current += 1
+        else:
+            stale.append((path,) + stamp)
+    return stale, current
+
+# _store_completed() (private) {{{1
+def _store_completed(pending, cache):
+    # waits for at least one batch to complete, stores the completed batches
+    # in a single transaction, and returns the number of songs stored
+    completed, still_pending = wait(pending, return_when=FIRST_COMPLETED)
+    pending.intersection_update(still_pending)
+    entries = [entry for future in completed for entry in future.result()]
+    cache.store_many(entries)
+    return len(entries)
+
+# _numpy_available() (private) {{{1
+def _numpy_available():
+    try:
+        import numpy
+        return True
+    except ImportError:
+        warn('NumPy is not installed, ReplayGain is only read from tags.')
+        return False
+
+# _gstreamer_available() (private) {{{1
+def _gstreamer_available():
+    # GStreamer is not loaded here, as it is best not initialized before the
+    # workers are forked
+    try:
+        import gi
+        gi.require_version('Gst', '1.0')
+        return True
+    except (ImportError, ValueError):
+        warn(
+            'GStreamer is not available,',
+            'ReplayGain is only computed for WAV files.'
+        )
+        return False
+
+# _report() (private) {{{1
+def _report(done, total, elapsed):
+    rate = done / elapsed if elapsed else 0
+    display(f'{done} of {total} songs read, {rate:.0f} per second.')
+
+# _start_worker() (private) {{{1
+def _start_worker():
+    # the timer is shared with the parent process, so it is disabled to
+    # prevent its output being interleaved
+    timer.enabled = False
+
+# _read_batch() (private) {{{1
+def _read_batch(keys, analyze, decode):
+    # runs in a worker process, the gain is computed if analyze is true, but
+    # only for WAV files unless decode is true, as GStreamer is needed for the
+    # others
+    entries = []
+    for key in keys:
+        path = Path(key[0])
+        try:
+            entries.append((key, _read_song(path, analyze, decode)))
+        except Exception as e:
+            # a song that cannot be read must not lose the rest of the batch
+            warn(f'{e.__class__.__name__}: {e}', culprit=path)
+    return entries
+
+# _read_song() (private) {{{1
+def _read_song(path, analyze, decode):
+    metadata = MetaData(path, None)
+    values = {name: getattr(metadata, name) for name in fields}
+    if analyze and metadata.gain is None and (
+        decode or path.suffix.lower() == '.wav'
+    ):
+        try:
+            gain, duration = measure_gain(path)
+            values['gain'] = gain
+            if values['duration'] is None:
+                values['duration'] = duration
+        except Error as e:
+            warn(e)
+    return values
@@ -0,0 +1,94 @@
+# RestartJournal class
+#
+# Maintains the restart file, which holds the command line followed by the
+# songs that have already been played.  The command line and the songs played
+# in earlier sessions are written when the journal is opened, and each song is
+# appended as it is played, so the file is always current even if mp is killed
+# or the machine loses power.  The file is flushed after every song, but is
+# only synced to disk periodically.  When the list of played songs is reset,
+# at the end of each pass through the songs, the file is compacted by
+# rewriting it.
+
+# Imports {{{1
+from .prefs import separator, restart_sync_interval
+from inform import Error, error, os_error
+from time import monotonic
+import os
+
+# read_restart_file() {{{1
+def read_restart_file(path):
+    # returns the command line and the songs already played
+    # raises OSError if the file cannot be read and Error if it is invalid
+    lines = path.read_text().split('\n')
+    # the last line is incomplete if mp was killed while writing it
+    lines = [line.strip() for line in lines[:-1]]
+    try:
+        partition = lines.index(separator)
+    except ValueError:
+        # file contents are not as expected
+        raise Error('invalid restart file.', culprit=path)
+    return lines[:partition], lines[partition+1:]
+
+# RestartJournal class {{{1
+class RestartJournal(object):
+    def __init__(self, path, command, played=()):
+        self.path = path
+        self.command = [str(arg) for arg in command]
+        self.file = None
+        self.last_sync = monotonic()
+        self.compact(played)
+
+    # record() {{{2
+    def record(self, song):
+        if not self.file:
+            return
+        try:
+            self.file.write(song + '\n')
+            self.file.flush()
+            if monotonic() - self.last_sync >= restart_sync_interval:
+                self._sync()
+        except OSError as e:
+            error(os_error(e))
+            self._close()
+
+    # compact() {{{2
+    def compact(self, played):
+        # replace the journal with one that contains only the command line and
+        # the given songs; the new version is written to a temporary file that
+        # is then renamed so that the journal is never left incomplete
+        self.close()
+        temp = self.path.with_name(self.path.name + '.new')
+        try:
+            with temp.open('w') as f:
+                f.write('\n'.join(self.command + [separator] + list(played)))
+                f.write('\n')
+                f.flush()
+                os.fsync(f.fileno())
+            temp.replace(self.path)
+            self.file = self.path.open('a')
+            self.last_sync = monotonic()
+        except OSError as e:
+            error(os_error(e))
+
+    # close() {{{2
+    def close(self):
+        if self.file:
+            try:
+                self._sync()
+            except OSError as e:
+                error(os_error(e))
+            self._close()
+
+    # _sync() (private) {{{2
+    def _sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.last_sync = monotonic()
+
+    # _close() (private) {{{2
+    def _close(self):
+        try:
+            self.file.close()
+        except OSError:
+            pass
+        self.file = None
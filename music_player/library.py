@@ -0,0 +1,178 @@
+# Library
+#
+# Used to find the files contained in a directory hierarchy.  The directories
+# are listed with os.scandir(), which provides the type of each entry without
+# a separate stat, and the directories found at each level of the hierarchy
+# are listed concurrently, which hides much of the latency of network
+# filesystems.
+#
+# The listings may also be kept in a persistent index.  An indexed listing is
+# used in place of listing the directory for as long as the modification time
+# of the directory is unchanged, so only the parts of the hierarchy that have
+# changed since the last scan need to be listed.
+
+# Imports {{{1
+from .cache import Cache
+from .prefs import scan_threads
+from concurrent.futures import ThreadPoolExecutor
+from inform import os_error, warn
+from time import time_ns
+import json
+import os
+import sqlite3
+
+# LibraryIndex class {{{1
+class LibraryIndex(Cache):
+    name = 'library index'
+    version = 1
+    tables = dict(
+        directories = 'path text primary key, mtime integer, entries text',
+    )
+    settling_time = 2_000_000_000
+        # directories modified within this many nanoseconds of the scan are
+        # not indexed, as they could be modified again without a discernible
+        # change in their modification time
+
+    def __init__(self, cache_path):
+        super().__init__(cache_path)
+        self.updates = []
+
+    # lookup() {{{2
+    def lookup(self, directory):
+        # returns the key for the directory along with its indexed entries as
+        # a list of (name, is_dir, is_file) tuples; the entries are None if the
+        # directory is not in the index or the index is out of date
+        if not self.connection:
+            return None, None
+        path = os.path.abspath(directory)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None, None
+        key = (path, mtime)
+        with self.lock:
+            try:
+                row = self.connection.execute(
+                    'select mtime, entries from directories where path = ?',
+                    (path,)
+                ).fetchone()
+            except sqlite3.Error as e:
+                self._disable(e)
+                return None, None
+        if row and row[0] == mtime:
+            return key, json.loads(row[1])
+        return key, None
+
+    # update() {{{2
+    def update(self, key, entries):
+        # queues an updated listing, it is written when commit() is called
+        if not key or key[1] > time_ns() - self.settling_time:
+            return
+        with self.lock:
+            self.updates.append(key + (json.dumps(entries),))
+
+    # commit() {{{2
+    def commit(self):
+        with self.lock:
+            updates, self.updates = self.updates, []
+            if not self.connection or not updates:
+                return
+            try:
+                self.connection.executemany(
+                    'insert or replace into directories (path, mtime, entries) '
+                    'values (?, ?, ?)',
+                    updates
+                )
+                self.connection.commit()
+            except sqlite3.Error as e:
+                self._disable(e)
+
+# scan_directory() {{{1
+def scan_directory(path, index=None):
+    # Generates the files contained in the directory hierarchy rooted at path
+    # as (path, is_file) tuples.  is_file is False for entries that are neither
+    # files nor directories, such as broken symbolic links.  The order is that
+    # of a depth-first traversal with each directory visited in the order given
+    # by the operating system, regardless of the order in which the directories
+    # were listed.  Files are generated as soon as their place in that order is
+    # known, so the first files are available long before the scan completes.
+    # If index is given, unchanged directories are taken from the index rather
+    # than being listed.
+    root = str(path)
+    listings = {}
+    stopped = False
+
+    def list_directory(directory):
+        # lists a directory and then queues up the listing of its
+        # subdirectories, so the whole hierarchy is listed concurrently
+        entries = _list_directory(directory, index)
+        if not stopped and not isinstance(entries, OSError):
+            for p, is_dir, is_file in entries:
+                if is_dir:
+                    listings[p] = pool.submit(list_directory, p)
+        return entries
+
+    def get_listing(directory):
+        entries = listings.pop(directory).result()
+        if isinstance(entries, OSError):
+            warn(os_error(entries))
+            return iter([])
+        return iter(entries)
+
+    pool = ThreadPoolExecutor(max_workers=scan_threads)
+    try:
+        listings[root] = pool.submit(list_directory, root)
+
+        # assemble the listings in order using an explicit stack
+        stack = [get_listing(root)]
+        while stack:
+            for path, is_dir, is_file in stack[-1]:
+                if is_dir:
+                    stack.append(get_listing(path))
+                    break
+                yield path, is_file
+            else:
+                stack.pop()
+    finally:
+        # if abandoned early, let the listings in progress complete but do not
+        # start any more; a listing that completes after this and tries to
+        # queue its subdirectories fails harmlessly, as its result is unused
+        stopped = True
+        pool.shutdown(cancel_futures=True)
+        if index:
+            index.commit()
+
+# _list_directory() (private) {{{1
+def _list_directory(path, index):
+    # returns the entries of a directory as (path, is_dir, is_file) tuples, or
+    # the exception if the directory could not be read
+    if index:
+        key, entries = index.lookup(path)
+        if entries is not None:
+            return [
+                (os.path.join(path, name), is_dir, is_file)
+                for name, is_dir, is_file in entries
+            ]
+    try:
+        with os.scandir(path) as entries:
+            entries = [
+                (entry.name, entry.is_dir(), entry.is_file())
+                for entry in entries
+                if not (entry.is_symlink() and _is_loop(entry.path))
+            ]
+    except OSError as e:
+        return e
+    if index:
+        index.update(key, entries)
+    return [
+        (os.path.join(path, name), is_dir, is_file)
+        for name, is_dir, is_file in entries
+    ]
+
+# _is_loop() (private) {{{1
+def _is_loop(path):
+    # a symbolic link that points to one of its own ancestors would cause the
+    # traversal to go on forever
+    target = os.path.realpath(path)
+    parent = os.path.realpath(os.path.dirname(path))
+    return os.path.commonpath([parent, target]) == target
@@ -0,0 +1,215 @@
+# Loudness
+#
+# Computes the ReplayGain of songs that do not carry it in their tags, for use
+# by mp --index.  The loudness of a song is its integrated loudness as defined
+# by ITU-R BS.1770 (as used by EBU R128 and ReplayGain 2.0): the audio is
+# K-weighted, its mean square is taken over 400 ms blocks that overlap by
+# 75%, blocks that are nearly silent or are more than 10 LU below the loudness
+# of the remaining blocks are discarded, and the loudness of what is left is
+# reported.  The gain is then the difference between the loudness and the
+# ReplayGain 2.0 reference of -18 LUFS.
+#
+# The song is decoded in batches of about a second and the arithmetic is
+# vectorized with NumPy, so only the mean square of each 100 ms segment is
+# kept.  WAV files are decoded with the wave module where possible, everything
+# else is decoded with GStreamer.  NumPy is required, and SciPy is needed to
+# apply the K-weighting filter; without it the loudness is unweighted, which
+# tends to overstate the loudness of songs with a lot of bass.
+
+# Imports {{{1
+from inform import Error, os_error
+from math import pi, tan
+import wave
+
+# Globals {{{1
+reference = -18
+    # ReplayGain 2.0 reference loudness in LUFS
+analysis_rate = 48000
+    # rate at which GStreamer decodes the songs
+segment_time = 0.1
+    # blocks are 4 segments long and start at every segment
+
+# measure_gain() {{{1
+def measure_gain(path):
+    # returns the ReplayGain of the song in dB and its duration in seconds,
+    # raises Error if it cannot be decoded or NumPy or, for songs other than
+    # simple WAV files, GStreamer is not available
+    try:
+        import numpy
+    except ImportError:
+        raise Error('NumPy is required to compute the gain.', culprit=path)
+    batches = None
+    try:
+        if path.suffix.lower() == '.wav':
+            rate, batches = _decode_wave(path, numpy)
+        if batches is None:
+            rate, batches = analysis_rate, _decode_gstreamer(path, numpy)
+        loudness, frames = _measure_loudness(batches, rate, numpy)
+    except (ValueError, EOFError, wave.Error) as e:
+        # the song is damaged, perhaps truncated
+        raise Error(e, culprit=path)
+    if loudness is None:
+        return None, frames / rate
+    return reference - loudness, frames / rate
+
+# _measure_loudness() (private) {{{1
+def _measure_loudness(batches, rate, np):
+    # returns the integrated loudness in LUFS and the number of frames,
+    # the loudness is None if the song is silent
+    step = round(segment_time * rate)
+    weighting = _k_weighting(rate)
+    states = None
+    leftover = None
+    segments = []
+    frames = 0
+    for batch in batches:
+        frames += len(batch)
+        if weighting:
+            # the filter states are carried from one batch to the next
+            lfilter, filters = weighting
+            if states is None:
+                states = [np.zeros((2, batch.shape[1])) for f in filters]
+            for i, (b, a) in enumerate(filters):
+                batch, states[i] = lfilter(b, a, batch, axis=0, zi=states[i])
+        squared = batch * batch
+        if leftover is not None:
+            squared = np.concatenate((leftover, squared))
+        whole = len(squared) - len(squared) % step
+        if whole:
+            segments.append(
+                squared[:whole].reshape(-1, step, squared.shape[1]).mean(axis=1)
+            )
+        leftover = squared[whole:]
+    if not segments:
+        return None, frames
+
+    # sum the channels, all are given the same weight
+    power = np.concatenate(segments).sum(axis=1)
+    if len(power) >= 4:
+        blocks = (power[:-3] + power[1:-2] + power[2:-1] + power[3:]) / 4
+    else:
+        blocks = np.array([power.mean()])
+    with np.errstate(divide='ignore'):
+        loudness = -0.691 + 10 * np.log10(blocks)
+    gated = blocks[loudness > -70]
+    if not len(gated):
+        return None, frames
+    threshold = -0.691 + 10 * np.log10(gated.mean()) - 10
+    gated = blocks[(loudness > -70) & (loudness > threshold)]
+    return float(-0.691 + 10 * np.log10(gated.mean())), frames
+
+# _k_weighting() (private) {{{1
+def _k_weighting(rate):
+    # Returns the function that applies a filter along with the coefficients
+    # of the two biquads that make up the K-weighting filter for the sample
+    # rate, or None if SciPy is not available.  The filter is a high shelf
+    # that models the head followed by a high pass, as given by libebur128.
+    try:
+        from scipy.signal import lfilter
+    except ImportError:
+        return None
+    filters = []
+
+    f0, gain, q = 1681.974450955533, 3.999843853973347, 0.7071752369554196
+    k = tan(pi * f0 / rate)
+    vh = 10 ** (gain / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    filters.append((
+        [(vh + vb * k / q + k * k) / a0, 2 * (k * k - vh) / a0,
+         (vh - vb * k / q + k * k) / a0],
+        [1, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0],
+    ))
+
+    f0, q = 38.13547087602444, 0.5003270373238773
+    k = tan(pi * f0 / rate)
+    a0 = 1 + k / q + k * k
+    filters.append((
+        [1, -2, 1],
+        [1, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0],
+    ))
+    return lfilter, filters
+
+# _decode_wave() (private) {{{1
+def _decode_wave(path, np):
+    # returns the sample rate and a generator of batches of samples, each an
+    # array of frames by channels scaled to lie between -1 and 1, or None for
+    # both if the file is not in a form the wave module understands, such as
+    # compressed or floating point samples
+    try:
+        song = wave.open(str(path))
+    except OSError as e:
+        raise Error(os_error(e))
+    except (EOFError, wave.Error):
+        return None, None
+    rate = song.getframerate()
+    channels = song.getnchannels()
+    width = song.getsampwidth()
+
+    def batches():
+        with song:
+            while True:
+                data = song.readframes(rate)
+                data = data[:len(data) - len(data) % (width * channels)]
+                    # a truncated file may end part way through a frame
+                if not data:
+                    return
+                if width == 1:
+                    samples = np.frombuffer(data, np.uint8) / 128 - 1
+                elif width == 3:
+                    # widen to 32 bits by adding a low byte of zero
+                    padded = np.zeros((len(data) // 3, 4), np.uint8)
+                    padded[:, 1:] = np.frombuffer(data, np.uint8).reshape(-1, 3)
+                    samples = padded.view('<i4').ravel() / 2**31
+                else:
+                    samples = np.frombuffer(data, f'<i{width}') / 2**(8*width - 1)
+                yield samples.reshape(-1, channels)
+    return rate, batches()
+
+# _decode_gstreamer() (private) {{{1
+def _decode_gstreamer(path, np):
+    # generates batches of samples, as _decode_wave(), resampled to the
+    # analysis rate and mixed to stereo
+    from .player import load_gstreamer
+        # imported here as the player imports this module indirectly
+    try:
+        GLib, Gst = load_gstreamer()
+    except (ImportError, ValueError) as e:
+        # ValueError indicates GStreamer is missing from GObject introspection
+        raise Error('GStreamer is required to decode:', e, culprit=path)
+    try:
+        pipeline = Gst.parse_launch(
+            'filesrc name=source ! decodebin ! audioconvert ! audioresample ! '
+            'audio/x-raw,format=F32LE,layout=interleaved,channels=2,'
+            f'rate={analysis_rate} ! appsink name=sink sync=false'
+        )
+    except GLib.Error as e:
+        # an element is missing
+        raise Error(e.message, culprit=path)
+    pipeline.get_by_name('source').set_property('location', str(path))
+    sink = pipeline.get_by_name('sink')
+    pipeline.set_state(Gst.State.PLAYING)
+    try:
+        pending = []
+        size = 0
+        while True:
+            sample = sink.emit('pull-sample')
+            if sample is None:
+                # end of stream or an error
+                message = pipeline.get_bus().pop_filtered(Gst.MessageType.ERROR)
+                if message:
+                    err, debug = message.parse_error()
+                    raise Error(err.message, culprit=path)
+                break
+            buffer = sample.get_buffer()
+            pending.append(buffer.extract_dup(0, buffer.get_size()))
+            size += len(pending[-1])
+            if size >= 8 * analysis_rate:
+                # about one second of stereo 32 bit samples
+                yield np.frombuffer(b''.join(pending), '<f4').reshape(-1, 2)
+                pending = []
+                size = 0
+        if pending:
+            yield np.frombuffer(b''.join(pending), '<f4').reshape(-1, 2)
+    finally:
+        pipeline.set_state(Gst.State.NULL)
@@ -3,10 +3,15 @@
 # Used to access the music file metadata (title, artist, etc.).
 
 # Imports {{{1
-from inform import Color, join, os_error, warn
+from inform import Color, join
+from importlib import import_module
+import re
+from .cache import fields
+from .timing import timer
 from .prefs import (
     show_album, show_track, summary_sep, now_playing_sep,
-    title_color, artist_color, album_color, path_color, punct_color
+    title_color, artist_color, album_color, path_color, punct_color,
+    metadata_readers, default_metadata_readers,
 )
 title_color = Color(title_color, enable=Color.isTTY())
 artist_color = Color(artist_color, enable=Color.isTTY())
@@ -14,81 +19,100 @@ album_color = Color(album_color, enable=Color.isTTY())
 path_color = Color(path_color, enable=Color.isTTY())
 punct_color = Color(punct_color, enable=Color.isTTY())
 
+# Readers {{{1
+# The mutagen classes used to read metadata, along with the style of the tags
+# they return: either 'easy' (simple dictionary-like tags) or 'id3' (ID3
+# frames).
+reader_classes = dict(
+    easyid3 = ('mutagen.easyid3', 'EasyID3', 'easy'),
+    id3 = ('mutagen.id3', 'ID3', 'id3'),
+    mp3 = ('mutagen.mp3', 'MP3', 'id3'),
+    flac = ('mutagen.flac', 'FLAC', 'easy'),
+    oggvorbis = ('mutagen.oggvorbis', 'OggVorbis', 'easy'),
+    oggopus = ('mutagen.oggopus', 'OggOpus', 'easy'),
+    oggflac = ('mutagen.oggflac', 'OggFLAC', 'easy'),
+    mp4 = ('mutagen.easymp4', 'EasyMP4', 'easy'),
+    wave = ('mutagen.wave', 'WAVE', 'id3'),
+)
+
+def resolve_readers(names):
+    # converts a list of reader names to a list of (class, style) pairs,
+    # dropping any that are not available
+    resolved = []
+    for name in names:
+        module, cls, style = reader_classes[name]
+        try:
+            resolved.append((getattr(import_module(module), cls), style))
+        except (ImportError, AttributeError):
+            pass
+    return resolved
+
+# Readers are resolved once, when first needed, rather than for each file.
+# They are tried in the order given in prefs.py.  All mutagen errors derive
+# from MutagenError.
+readers = default_readers = None
+MutagenError = Exception
+
+def load_readers():
+    global readers, default_readers, MutagenError
+    if readers is None:
+        try:
+            from mutagen import MutagenError
+        except ImportError:
+            pass
+        readers = {
+            ext: resolve_readers(names)
+            for ext, names in metadata_readers.items()
+        }
+        default_readers = resolve_readers(default_metadata_readers)
+
 # MetaData constructor {{{1
 # I have a very weak understanding of the way metadata is implemented and why
 # this is so hard.
 class MetaData(object):
-    def __init__(self, media_path, now_playing_path):
+    def __init__(self, media_path, now_playing_path, cache=None):
         self.media_path = media_path
-        media_filename = str(media_path)
         self.now_playing_path = now_playing_path
         self.artist = None
         self.album = None
         self.title = None
         self.track = None
         self.volume = None
-        self.warned = False
+        self.year = None
+        self.duration = None
+        self.gain = None
+            # the ReplayGain of the song in dB
 
-        # Try EasyID3 metadata
-        try:
-            from mutagen.easyid3 import EasyID3
-            from mutagen import MutagenError
-            try:
-                metadata = EasyID3(media_filename)
-                self._get_easy_metadata(metadata)
+        # Use cached metadata if it is still valid
+        if cache:
+            key, cached = cache.lookup(media_path)
+            if cached:
+                for name, value in cached.items():
+                    setattr(self, name, value)
                 return
-            except MutagenError:
-                pass
-        except ImportError:
-            pass
 
-        # If that did not work, try ID3 metadata
-        try:
-            from mutagen.id3 import ID3, ID3NoHeaderError
-            try:
-                metadata = ID3(media_filename)
-                self._get_id3_metadata(metadata)
-                return
-            except ID3NoHeaderError:
-                pass
-        except ImportError:
-            pass
+        with timer.measure('parse', media_path):
+            self._read_metadata(str(media_path))
+        if cache:
+            cache.store(key, {name: getattr(self, name) for name in fields})
 
-        # If those did not work, filetype specific metadata
-        ext = media_path.suffix.lower()
-        if ext in ['.ogg', 'oga']:
+    # _read_metadata() (private) {{{1
+    def _read_metadata(self, media_filename):
+        # use the first reader for this type of file that succeeds
+        load_readers()
+        ext = self.media_path.suffix.lower()
+        for reader, style in readers.get(ext, default_readers):
             try:
-                from mutagen.oggvorbis import OggVorbis, OggVorbisHeaderError
-                try:
-                    metadata = OggVorbis(media_filename)
-                    self._get_easy_metadata(metadata)
-                    return
-                except OggVorbisHeaderError:
-                    pass
-            except ImportError:
-                pass
-        elif ext == '.mp3':
-            try:
-                from mutagen.mp3 import MP3, HeaderNotFoundError
-                try:
-                    metadata = MP3(media_filename)
-                    self._get_id3_metadata(metadata)
-                    return
-                except HeaderNotFoundError:
-                    pass
-            except ImportError:
-                pass
-        elif ext == '.flac':
-            try:
-                from mutagen.flac import FLAC, FLACNoHeaderError
-                try:
-                    metadata = FLAC(media_filename)
-                    self._get_easy_metadata(metadata)
-                    return
-                except FLACNoHeaderError:
-                    pass
-            except ImportError:
-                pass
+                metadata = reader(media_filename)
+            except MutagenError:
+                continue
+            if style == 'easy':
+                self._get_easy_metadata(metadata)
+            else:
+                self._get_id3_metadata(metadata)
+            info = getattr(metadata, 'info', None)
+            self.duration = getattr(info, 'length', None)
+            return
         # if we get here we failed to get the metadata
 
     # summary() {{{1
@@ -122,16 +146,10 @@ class MetaData(object):
             )
         )
 
-    # now_playing() {{{1
-    def now_playing(self):
-        if self.now_playing_path:
-            out = [each for each in [self.artist, self.title] if each]
-            try:
-                self.now_playing_path.write_text(f' {now_playing_sep} '.join(out))
-            except OSError as e:
-                if not self.warned:
-                    warn(os_error(e))
-                    self.warned = True
+    # now_playing_text() {{{1
+    def now_playing_text(self):
+        out = [each for each in [self.artist, self.title] if each]
+        return f' {now_playing_sep} '.join(out)
 
     # _get_easy_metadata() (private) {{{1
     def _get_easy_metadata(self, metadata):
@@ -140,6 +158,14 @@ class MetaData(object):
         self.title = metadata.get('title', [None])[0]
         self.track = metadata.get('tracknumber', [None])[0]
         self.volume = metadata.get('discnumber', [None])[0]
+        self.year = _year(metadata.get('date', [None])[0])
+        self.gain = _gain(metadata.get('replaygain_track_gain', [None])[0])
+        if self.gain is None:
+            # Opus gives the gain relative to the EBU R128 reference of -23
+            # LUFS in units of 1/256 dB, ReplayGain uses -18 LUFS
+            r128 = _gain(metadata.get('r128_track_gain', [None])[0])
+            if r128 is not None:
+                self.gain = r128 / 256 + 5
 
     # _get_id3_metadata() (private) {{{1
     def _get_id3_metadata(self, metadata):
@@ -163,3 +189,27 @@ class MetaData(object):
             self.volume = metadata['TPOS'].text[0]
         except KeyError:
             pass
+        try:
+            self.year = _year(str(metadata['TDRC'].text[0]))
+        except KeyError:
+            pass
+        for key in ['TXXX:REPLAYGAIN_TRACK_GAIN', 'TXXX:replaygain_track_gain']:
+            try:
+                self.gain = _gain(metadata[key].text[0])
+                break
+            except KeyError:
+                pass
+
+# _gain() (private) {{{1
+def _gain(gain):
+    # converts a gain such as -6.5 dB to a number
+    try:
+        return float(gain.split()[0])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+# _year() (private) {{{1
+def _year(date):
+    # extracts the year from a date such as 1961-05-01
+    match = re.match(r'\s*(\d{4})', date or '')
+    return int(match.group(1)) if match else None
@@ -0,0 +1,201 @@
+# NowPlaying class
+#
+# Publishes the song that is playing.  The artist and title are written to the
+# now playing file, as before.  The file is replaced atomically, by writing a
+# temporary file and renaming it, so a reader never sees it half written.  The
+# player delays writing the file slightly, so changes that come in quick
+# succession, such as when songs are skipped, are coalesced and only the last
+# is written.
+#
+# Optionally a JSON record of the song that includes its position and
+# duration is also published, once per second while playing and whenever the
+# song or the state of the player changes:
+#
+# To a named pipe: each update is written as a line.  The pipe is written
+# without blocking, so updates are simply dropped when there is no reader or
+# the reader falls behind.  Consumers need not poll, they just read lines.
+# Python ignores SIGPIPE, so a reader going away just ends the writing.
+#
+# To a memory-mapped record: a file of record_size bytes that holds an
+# 8 byte sequence number, a 4 byte length, and then the JSON text, with the
+# numbers in native byte order.  The sequence number is odd while the record is
+# being written, so readers should read it again if the sequence number is odd
+# or changes while they read.
+
+# Imports {{{1
+from inform import os_error, warn
+from pathlib import Path
+from time import time
+import errno
+import json
+import mmap
+import os
+import stat
+import struct
+
+# Globals {{{1
+record_size = 4096
+header = struct.Struct('=QI')
+
+# write_atomically() {{{1
+def write_atomically(path, text):
+    temp = path.with_name(path.name + '.new')
+    temp.write_text(text)
+    temp.replace(path)
+
+# NowPlaying class {{{1
+class NowPlaying(object):
+    def __init__(self, path, fifo_path=None, record_path=None):
+        # the paths of the pipe and record are given in the settings, where
+        # they may start with ~
+        if fifo_path:
+            fifo_path = Path(fifo_path).expanduser()
+        if record_path:
+            record_path = Path(record_path).expanduser()
+        self.path = path
+        self.fifo_path = fifo_path
+        self.fifo = None
+            # file descriptor of the named pipe while it has a reader
+        self.record = None
+        self.metadata = None
+        self.warned = set()
+        if fifo_path:
+            self._make_fifo(fifo_path)
+        if record_path:
+            self._open_record(record_path)
+
+    # publishing {{{2
+    @property
+    def publishing(self):
+        # true if updates of the position are wanted
+        return bool(self.fifo_path or self.record)
+
+    # publish() {{{2
+    def publish(self, metadata):
+        # publishes a change of song to the named pipe and record, the now
+        # playing file is not written until write_file() is called
+        self.metadata = metadata
+        self.update('playing', 0)
+
+    # update() {{{2
+    def update(self, state, position=None, duration=None):
+        # publishes the state of the player and the position in the song to
+        # the named pipe and record
+        if not self.publishing:
+            return
+        metadata = self.metadata
+        if metadata and duration is None:
+            duration = metadata.duration
+        text = json.dumps(dict(
+            state = state if metadata else 'stopped',
+            artist = metadata.artist if metadata else None,
+            album = metadata.album if metadata else None,
+            title = metadata.title if metadata else None,
+            path = str(metadata.media_path) if metadata else None,
+            position = position,
+            duration = duration,
+            time = time(),
+        ))
+        if self.fifo_path:
+            self._write_fifo(text)
+        if self.record:
+            self._write_record(text)
+
+    # stop() {{{2
+    def stop(self):
+        # publishes that nothing is playing
+        self.metadata = None
+        self.update('stopped')
+
+    # close() {{{2
+    def close(self):
+        self.stop()
+        self._close_fifo()
+        if self.record:
+            self.record.close()
+            self.record = None
+
+    # write_file() {{{2
+    def write_file(self):
+        # writes the artist and title of the song to the now playing file
+        if self.path and self.metadata:
+            try:
+                write_atomically(self.path, self.metadata.now_playing_text())
+            except OSError as e:
+                self._warn(e)
+
+    # _make_fifo() (private) {{{2
+    def _make_fifo(self, path):
+        try:
+            if not stat.S_ISFIFO(path.stat().st_mode):
+                warn('not a named pipe.', culprit=path)
+                self.fifo_path = None
+        except FileNotFoundError:
+            try:
+                os.mkfifo(path)
+            except OSError as e:
+                warn(os_error(e))
+                self.fifo_path = None
+
+    # _write_fifo() (private) {{{2
+    def _write_fifo(self, text):
+        # the pipe is held open once a reader appears, so the reader does not
+        # see an end of file after each update
+        if self.fifo is None:
+            try:
+                self.fifo = os.open(self.fifo_path, os.O_WRONLY | os.O_NONBLOCK)
+            except OSError as e:
+                if e.errno != errno.ENXIO:
+                    # ENXIO indicates there is no reader
+                    self._warn(e)
+                return
+        try:
+            os.write(self.fifo, text.encode() + b'\n')
+        except BlockingIOError:
+            pass
+        except OSError as e:
+            if e.errno != errno.EPIPE:
+                # EPIPE indicates the reader has gone
+                self._warn(e)
+            self._close_fifo()
+
+    # _close_fifo() (private) {{{2
+    def _close_fifo(self):
+        if self.fifo is not None:
+            os.close(self.fifo)
+            self.fifo = None
+
+    # _open_record() (private) {{{2
+    def _open_record(self, path):
+        try:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                os.ftruncate(fd, record_size)
+                self.record = mmap.mmap(fd, record_size)
+            finally:
+                os.close(fd)
+        except OSError as e:
+            warn(os_error(e))
+
+    # _write_record() (private) {{{2
+    def _write_record(self, text):
+        data = text.encode()
+        if header.size + len(data) > record_size:
+            self._warn('too long for the now playing record.')
+            return
+        record = self.record
+        sequence, length = header.unpack_from(record)
+        sequence += 1 + (sequence & 1)
+        header.pack_into(record, 0, sequence, length)
+            # odd, the record is being written
+        record[header.size:header.size + len(data)] = data
+        header.pack_into(record, 0, sequence + 1, len(data))
+
+    # _warn() (private) {{{2
+    def _warn(self, e):
+        # warn of each problem only once, as they tend to recur with every
+        # update
+        message = os_error(e) if isinstance(e, OSError) else e
+        if message not in self.warned:
+            self.warned.add(message)
+            warn(message)
@@ -2,124 +2,705 @@
 
 # Imports {{{1
 from .prefs import (
-    media_file_extensions, restart_path,
+    media_file_extensions, restart_path, metadata_cache_path,
+    library_index_path, play_history_path, prefetch_songs, prefetch_threads,
+    prefetch_readahead, now_playing_delay, now_playing_fifo,
+    now_playing_record, now_playing_interval, replay_gain,
+    replay_gain_preamp, replay_gain_max_volume, audio_cache_size,
+    audio_cache_path, source_readahead,
     skip_song_that_was_playing_when_last_killed
 )
+from .audiocache import AudioCache
+from .cache import MetaDataCache, PlayHistory
+from .indexer import index_songs
+from .library import LibraryIndex, scan_directory
 from .metadata import MetaData
-from inform import Error, error, display, join, os_error, warn
+from .nowplaying import NowPlaying
+from .playlist import read_playlist, write_playlist
+from .query import find_songs
+from .readahead import ReadAhead
+from .shuffle import shuffle
+from .songs import SongList
+from .timing import timer
+from inform import Error, error, display, os_error, warn
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from time import sleep
-try:
-    import thread
-except ImportError:
-    import _thread
-import gi
-gi.require_version('Gst', '1.0')
-from gi.repository import GObject, Gst
-Gst.init(None)
+from queue import Empty, Queue
+from random import Random
+from threading import Thread
+import os
 import sys
 
+# load_gstreamer() {{{1
+# GStreamer takes a noticeable time to load and initialize, so it is not
+# loaded until it is needed, which allows playlists to be generated quickly.
+GLib = Gst = None
+def load_gstreamer():
+    global GLib, Gst
+    if not Gst:
+        import gi
+        gi.require_version('Gst', '1.0')
+        from gi.repository import GLib, Gst
+        Gst.init(None)
+    return GLib, Gst
+
 # Player constructor{{{1
 class Player(object):
-    def __init__(self, now_playing_path = None, informer=None):
+    def __init__(self, now_playing_path = None, informer=None, gapless=False):
+        self.player = None
+            # the playbin, built when first needed by _build_pipeline()
+        self.gapless = gapless
+        self.informer = informer
+        self.now_playing_path = now_playing_path
+        self.metadata_cache = (
+            MetaDataCache(metadata_cache_path) if metadata_cache_path else None
+        )
+        self.library_index = (
+            LibraryIndex(library_index_path) if library_index_path else None
+        )
+        self.play_history = (
+            PlayHistory(play_history_path) if play_history_path else None
+        )
+        self.audio_cache = (
+            AudioCache(audio_cache_path, audio_cache_size)
+            if audio_cache_size else None
+        )
+        self.songs = SongList()
+        self.rng = Random()
+            # used for all shuffling, seed it to reproduce a shuffled session
+        self.playlists = {}
+            # remembered playlist expansions, see _open_playlist()
+        self.played = {}
+            # a dictionary is used as an ordered set, it provides fast
+            # membership tests while retaining the order songs were played
+        self.journal = None
+            # restart journal, songs are recorded in it as they are played
+        self.queue = iter([])
+        self.enqueued = deque()
+            # songs added by enqueue(), played after those in the queue
+        self.discovered = None
+            # queue of songs found by stream_songs() and not yet taken
+        self.shuffle_discovered = False
+        self.found = None
+            # songs discovered but not yet taken by _take_discovered()
+        self.current = None
+        self.metadata = None
+            # the metadata of the current song
+        self.paused = False
+        self.pending = None
+            # in gapless mode, the song that follows the current song
+        self.preloaded = None
+            # in gapless mode, the song queued in the player to follow the
+            # current song; it starts when the player reports a new stream
+        self.upcoming = deque()
+            # songs that follow the current song, taken from the queue early
+            # so their metadata can be prefetched
+        self.prefetched = {}
+            # futures for the metadata of the upcoming songs
+        self.prefetcher = (
+            ThreadPoolExecutor(max_workers=prefetch_threads)
+            if prefetch_songs else None
+        )
+        self.publisher = NowPlaying(
+            now_playing_path, now_playing_fifo, now_playing_record
+        )
+        self.now_playing_timer = None
+            # the GLib source that writes the now playing file
+        self.position_timer = None
+            # the GLib source that publishes the position in the song
+        self.source_path = None
+            # the song the next source created by the playbin is to read
+        self.readers = []
+            # the read-ahead threads of the current and previous songs
+        self.quit = None
+        self.quiet = False
+
+    # _build_pipeline() (private) {{{1
+    def _build_pipeline(self):
+        load_gstreamer()
         player = Gst.ElementFactory.make("playbin", "player")
         fakesink = Gst.ElementFactory.make("fakesink", "fakesink")
         player.set_property("video-sink", fakesink)
+        if self.gapless:
+            player.connect("about-to-finish", self._about_to_finish)
         bus = player.get_bus()
         bus.add_signal_watch()
         bus.connect("message", self._process_message)
+        if source_readahead:
+            player.connect("source-setup", self._setup_source)
         self.player = player
-        self.informer = informer
-        self.now_playing_path = now_playing_path
-        self.songs = []
-        self.played = []
-        self.playing = False
 
     # _process_message() (private) {{{1
     def _process_message(self, bus, message):
         if message.type == Gst.MessageType.EOS:
+            timer.start('transition')
             self.player.set_state(Gst.State.NULL)
-            self.playing = False
+            self._song_finished()
         elif message.type == Gst.MessageType.ERROR:
+            timer.start('transition')
             self.player.set_state(Gst.State.NULL)
             err, debug = message.parse_error()
             error(err, debug)
-                # cannot raise Error cause we are in a different thread and so
-                # error will not be caught
-            self.playing = False
+                # cannot raise Error cause we are in a callback from the main
+                # loop and so error will not be caught
+            self._song_finished()
+        elif message.type == Gst.MessageType.STREAM_START:
+            if self.preloaded:
+                # the player has moved on to the preloaded song
+                song_filename, self.preloaded = self.preloaded, None
+                self.pending = None
+                self._mark_finished()
+                self._start_song(song_filename)
+                self._look_ahead()
+        elif message.type == Gst.MessageType.STATE_CHANGED:
+            if timer.enabled and message.src == self.player:
+                self._time_state_change(*message.parse_state_changed())
+
+    # _time_state_change() (private) {{{1
+    def _time_state_change(self, old, new, pending):
+        # Starting a song takes the pipeline from NULL through READY to PAUSED,
+        # which requires it to preroll (fill itself with data), and then to
+        # PLAYING.
+        if new == Gst.State.PAUSED and old == Gst.State.READY:
+            timer.stop('preroll', self.current)
+            timer.start('preroll to playing')
+        elif new == Gst.State.PLAYING:
+            timer.stop('preroll to playing', self.current)
+            timer.stop('start', self.current)
+            timer.stop('transition', self.current)
+
+    # _setup_source() (private) {{{1
+    def _setup_source(self, player, source):
+        # Called as the playbin creates the appsrc for a song, possibly from a
+        # streaming thread.  The reader of the previous song is retained, as
+        # in gapless mode it may still be finishing.
+        for reader in self.readers[:-1]:
+            reader.stop()
+        self.readers = self.readers[-1:] + [
+            ReadAhead(self.source_path, source, int(source_readahead), Gst)
+        ]
+
+    # _about_to_finish() (private) {{{1
+    def _about_to_finish(self, player):
+        # Called from a streaming thread as the current song nears its end.
+        # Queuing the next song here allows the player to start decoding it
+        # before the current song ends, so the songs play without a gap.
+        song_filename = self.pending
+        if song_filename:
+            self.preloaded = song_filename
+            player.set_property("uri", self._uri(song_filename))
 
     # add_songs() {{{1
     def add_songs(self, paths, cwd='.'):
-        for path in paths:
-            path = Path(cwd, path).expanduser()
-            if path.is_file():
+        with timer.measure('scan'):
+            self.songs += self._find_songs(paths, cwd)
+        if not self.songs:
+            raise Error('playlist is empty.')
+
+    # add_query() {{{1
+    def add_query(self, query):
+        # adds the songs whose cached metadata matches the query
+        if not self.metadata_cache:
+            raise Error('metadata cache is disabled, cannot query.')
+        songs = find_songs(self.metadata_cache, query)
+        if not songs:
+            raise Error('no songs match.', culprit=query)
+        self.songs += songs
+
+    # index_songs() {{{1
+    def index_songs(self, paths):
+        # reads the metadata of the songs into the metadata cache rather than
+        # playing them, returns the number read and the number already cached
+        if not self.metadata_cache:
+            raise Error('metadata cache is disabled, cannot index.')
+        with timer.measure('scan'):
+            songs = list(self._find_songs(paths))
+        return index_songs(songs, self.metadata_cache)
+
+    # stream_songs() {{{1
+    def stream_songs(self, paths, shuffle=False):
+        # Like add_songs(), except the songs are found in the background and
+        # play() starts as soon as the first song is found.  If shuffle is
+        # requested, each song played is chosen at random from those found
+        # but not yet played.
+        self.discovered = Queue()
+        self.shuffle_discovered = shuffle
+        Thread(target=self._discover, args=(paths,), daemon=True).start()
+
+    # _discover() (private) {{{1
+    def _discover(self, paths):
+        # runs in the background thread started by stream_songs()
+        try:
+            with timer.measure('scan'):
+                for song in self._find_songs(paths):
+                    self.discovered.put(song)
+        except Error as e:
+            e.report()
+        finally:
+            self.discovered.put(None)
+
+    # _find_songs() (private) {{{1
+    def _find_songs(self, paths, cwd='.'):
+        # Generates the songs found in paths, expanding directories and
+        # playlists.  An explicit stack is used rather than recursion, so
+        # deeply nested playlists are not limited by the recursion limit.
+        # Each stack frame holds an iterator over the items to process and
+        # the kind of the items: 'paths' (paths relative to cwd), 'directory'
+        # (the output of scan_directory()) or 'expansion' (a remembered
+        # playlist expansion).  The frames of playlists also hold the
+        # resolved path of the playlist, used to detect playlists that include
+        # themselves, and the expansion being recorded.  An expansion that
+        # omits a playlist because it includes itself depends on how it was
+        # reached, so it is not remembered.  Playlists and directories are
+        # recorded in an expansion by reference, so a directory is scanned
+        # afresh each time the expansion is used.
+        active = set()
+        partial = set()
+            # the active playlists whose expansions omit such a playlist
+        stack = [(iter(paths), 'paths', cwd, None, None, None)]
+        while stack:
+            items, kind, cwd, playlist, expansion, memo = stack[-1]
+            for item in items:
+                if kind == 'paths':
+                    path = Path(cwd, item).expanduser()
+                    if not path.is_file():
+                        if path.is_dir():
+                            if expansion is not None:
+                                expansion.append(path)
+                            stack.append((
+                                scan_directory(path, self.library_index),
+                                'directory', None, None, None, None
+                            ))
+                            break
+                        if not self.informer.quiet:
+                            warn('not found.', culprit=path)
+                        continue
+                elif kind == 'directory':
+                    path, is_file = item
+                    if not is_file:
+                        if not self.informer.quiet:
+                            warn('not found.', culprit=path)
+                        continue
+                    path = Path(path)
+                elif isinstance(item, str):
+                    # a song from a remembered expansion
+                    yield item
+                    continue
+                else:
+                    # a playlist or directory included by a remembered
+                    # expansion
+                    path = item
+                    if path.is_dir():
+                        stack.append((
+                            scan_directory(path, self.library_index),
+                            'directory', None, None, None, None
+                        ))
+                        break
+
                 ext = path.suffix.lower()
                 if ext in media_file_extensions:
-                    self.songs += [str(path)]
+                    song = str(path)
+                    if expansion is not None:
+                        expansion.append(song)
+                    yield song
                 elif ext == '.m3u':
-                    try:
-                        playlist = path.read_text()
-                        lines = [l.strip() for l in playlist.splitlines()]
-                        self.add_songs(
-                            [l for l in lines if l and l[0] != '#'],
-                            path.parent
-                        )
-                    except OSError as e:
-                        raise Error(os_error(e))
+                    frame = self._open_playlist(path, active)
+                    if frame:
+                        if expansion is not None:
+                            expansion.append(path)
+                        active.add(frame[3])
+                        stack.append(frame)
+                        break
+                    # the playlist includes itself, which affects the
+                    # playlists expanded since it was opened
+                    resolved = path.resolve()
+                    playlists = [f[3] for f in stack]
+                    partial.update(
+                        playlists[playlists.index(resolved) + 1:]
+                    )
                 elif path.stem != restart_path.stem:
                     if not self.informer.quiet:
                         warn('skipping descriptor of unknown type.', culprit=path)
-            elif path.is_dir():
-                self.add_songs(path.iterdir())
             else:
-                if not self.informer.quiet:
-                    warn('not found.', culprit=path)
-        if not self.songs:
-            raise Error('playlist is empty.')
+                # all items processed, close the frame
+                stack.pop()
+                if playlist:
+                    active.discard(playlist)
+                if memo and playlist not in partial:
+                    self.playlists[memo[0]] = (memo[1], expansion)
+                partial.discard(playlist)
 
-    # write_playlist() {{{1
-    def write_playlist(self, path):
+    # _open_playlist() (private) {{{1
+    def _open_playlist(self, path, active):
+        # Returns a stack frame for _find_songs() that expands the playlist,
+        # either by reading it or, if it is unchanged since it was last read,
+        # from its remembered expansion.  Returns None if the playlist is
+        # already being expanded, as it includes itself.  Expansions are
+        # remembered separately for each way the playlist is referred to,
+        # as the paths of the songs it contains depend on that.
+        resolved = path.resolve()
+        if resolved in active:
+            warn('playlist includes itself, ignored.', culprit=path)
+            return None
         try:
-            path.write_text(join(*self.songs))
+            mtime = path.stat().st_mtime_ns
         except OSError as e:
             raise Error(os_error(e))
+        key = (resolved, str(path.parent))
+        remembered = self.playlists.get(key)
+        if remembered and remembered[0] == mtime:
+            return (
+                iter(remembered[1]), 'expansion', None, resolved, None, None
+            )
+        return (
+            read_playlist(path), 'paths', path.parent, resolved, [],
+            (key, mtime)
+        )
+
+    # _take_discovered() (private) {{{1
+    def _take_discovered(self):
+        # Generates the songs found by stream_songs() as they become available
+        # and adds them to the list of songs, so they are available to any
+        # repeats.  Only waits if all the songs found so far have been taken.
+        found = self.found = [] if self.shuffle_discovered else deque()
+        done = False
+        while found or not done:
+            while not done:
+                try:
+                    song = self.discovered.get(block=not found)
+                except Empty:
+                    break
+                if song is None:
+                    done = True
+                else:
+                    self.songs.append(song)
+                    found.append(song)
+            if not found:
+                continue
+            if self.shuffle_discovered:
+                i = self.rng.randrange(len(found))
+                found[i], found[-1] = found[-1], found[i]
+                yield found.pop()
+            else:
+                yield found.popleft()
+        self.discovered = None
+        if not self.songs:
+            error('playlist is empty.')
+
+    # write_playlist() {{{1
+    def write_playlist(self, path, extended=False):
+        # if extended, durations and titles are included for those songs
+        # whose metadata is cached
+        write_playlist(
+            path, self.songs, self.metadata_cache if extended else None
+        )
 
     # add_skips() {{{1
     def add_skips(self, paths):
-        self.played = paths
+        self.played = dict.fromkeys(paths)
 
     # shuffle_songs() {{{1
-    def shuffle_songs(self):
-        from random import shuffle
-        shuffle(self.songs)
+    def shuffle_songs(self, mode='songs'):
+        # see shuffle.py for the modes
+        shuffle(
+            self.songs, mode, self.rng, self.metadata_cache, self.play_history
+        )
 
     # play() {{{1
     def play(self, quit, quiet):
-        for song_filename in self.songs:
-            if song_filename in self.played:
-                continue
-            if skip_song_that_was_playing_when_last_killed:
-                self.played.append(song_filename)
-            self.playing = True
-            song_path = Path(song_filename).expanduser()
-            metadata = MetaData(song_path, self.now_playing_path)
-            metadata.now_playing()
-            if not quiet:
-                display(metadata.summary())
-            self.player.set_property("uri", "file://" + str(song_path.resolve()))
+        # Starts the first song and returns. The remaining songs are started
+        # from _process_message() as the GLib main loop delivers the end of
+        # stream messages. quit() is called once all songs have been played.
+        if not self.player:
+            self._build_pipeline()
+        if self.discovered:
+            self.queue = self._take_discovered()
+        else:
+            self.queue = iter(self.songs)
+        self.pending = None
+        self.upcoming = deque()
+        self.prefetched = {}
+        self.quit = quit
+        self.quiet = quiet
+        self._play_next_song()
+
+    # _play_next_song() (private) {{{1
+    def _play_next_song(self):
+        self.preloaded = None
+        self.paused = False
+        song_filename = self._next_song()
+        if song_filename:
+            self._start_song(song_filename)
+            with timer.measure('uri', song_filename):
+                self.player.set_property("uri", self._uri(song_filename))
+            timer.start('start')
+            timer.start('preroll')
+            self.player.set_state(Gst.State.PLAYING)
+            self._look_ahead()
+            return
+        self.current = None
+        self.metadata = None
+        self.publisher.stop()
+        self.played = {}
+        self.prefetched = {}
+        if self.journal:
+            self.journal.compact([])
+        GLib.idle_add(self.quit)
+            # quit from an idle callback so it is safe to call play() before
+            # the main loop is running
+
+    # _next_song() (private) {{{1
+    def _next_song(self, wait=True):
+        # returns the next song that has not yet been played, or None; unless
+        # wait is true, None is also returned if the next song has not yet been
+        # discovered
+        if self.pending:
+            song_filename, self.pending = self.pending, None
+            return song_filename
+        while True:
+            if self.upcoming:
+                song_filename = self.upcoming.popleft()
+            else:
+                song_filename = self._take_next(wait)
+                if song_filename is None:
+                    return None
+            if song_filename not in self.played and song_filename != self.current:
+                return song_filename
+            self.prefetched.pop(song_filename, None)
+
+    # _take_next() (private) {{{1
+    def _take_next(self, wait=True):
+        # returns the next song from the queue, then from the enqueued songs;
+        # unless wait is true, returns None rather than waiting for a song to
+        # be discovered
+        if not wait and self.discovered:
+            if not self.found and self.discovered.empty():
+                return None
+        song_filename = next(self.queue, None)
+        if song_filename is None and self.enqueued:
+            song_filename = self.enqueued.popleft()
+        return song_filename
+
+    # _prefetch() (private) {{{1
+    def _prefetch(self):
+        # read the metadata for the upcoming songs in the background so that
+        # it is ready when they start
+        if not self.prefetcher:
+            return
+        while len(self.upcoming) < prefetch_songs:
+            song_filename = self._take_next(wait=False)
+            if song_filename is None:
+                break
+            if song_filename not in self.played:
+                self.upcoming.append(song_filename)
+        for song_filename in self.upcoming:
+            if song_filename not in self.prefetched:
+                self.prefetched[song_filename] = self.prefetcher.submit(
+                    self._read_metadata, song_filename,
+                    prefetch_readahead and not self.audio_cache
+                )
+                if self.audio_cache:
+                    # copying the song into the cache also reads it ahead; it
+                    # is a separate task so the song need not wait for it to
+                    # start, it is played from the original until it is copied
+                    self.prefetcher.submit(
+                        self.audio_cache.fetch,
+                        Path(song_filename).expanduser()
+                    )
+
+    # _read_metadata() (private) {{{1
+    def _read_metadata(self, song_filename, readahead=False):
+        song_path = Path(song_filename).expanduser()
+        if readahead:
+            # ask the operating system to start reading the file into the
+            # page cache
+            try:
+                fd = os.open(song_path, os.O_RDONLY)
+                try:
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+                finally:
+                    os.close(fd)
+            except (OSError, AttributeError):
+                pass
+        return MetaData(song_path, self.now_playing_path, self.metadata_cache)
+
+    # _start_song() (private) {{{1
+    def _start_song(self, song_filename):
+        if skip_song_that_was_playing_when_last_killed:
+            self._mark_played(song_filename)
+        self.current = song_filename
+        prefetched = self.prefetched.pop(song_filename, None)
+        with timer.measure('metadata', song_filename):
+            # for prefetched songs this is the time spent waiting for it
+            if prefetched:
+                metadata = prefetched.result()
+            else:
+                metadata = self._read_metadata(song_filename)
+        self.metadata = metadata
+        if replay_gain:
+            self._apply_gain(metadata)
+        self._publish(metadata)
+        if not self.quiet:
+            display(metadata.summary())
+
+    # _look_ahead() (private) {{{1
+    def _look_ahead(self):
+        # Called once the current song has started.  Chooses the song that
+        # follows it in gapless mode and prefetches the upcoming songs, but
+        # only from the songs available, so it never waits on discovery.
+        if self.gapless:
+            self.pending = self._next_song(wait=False)
+        self._prefetch()
+
+    # _apply_gain() (private) {{{1
+    def _apply_gain(self, metadata):
+        # sets the volume of the playbin from the ReplayGain of the song, in
+        # gapless mode this occurs as the song starts
+        volume = 1
+        if metadata.gain is not None:
+            volume = min(
+                10 ** ((metadata.gain + replay_gain_preamp) / 20),
+                replay_gain_max_volume
+            )
+        self.player.set_property("volume", volume)
+
+    # _publish() (private) {{{1
+    def _publish(self, metadata):
+        # The now playing file is written from a timeout, so if songs change
+        # in quick succession only the last is written.  If the position is
+        # published, a timeout that does so runs until playing stops.
+        self.publisher.publish(metadata)
+        if not self.now_playing_timer:
+            self.now_playing_timer = GLib.timeout_add(
+                int(1000 * now_playing_delay), self._write_now_playing
+            )
+        if self.publisher.publishing and not self.position_timer:
+            self.position_timer = GLib.timeout_add(
+                int(1000 * now_playing_interval), self._publish_position
+            )
+
+    # _write_now_playing() (private) {{{1
+    def _write_now_playing(self):
+        self.now_playing_timer = None
+        with timer.measure('now playing'):
+            self.publisher.write_file()
+        return False
+            # returning False removes the timeout
+
+    # _publish_position() (private) {{{1
+    def _publish_position(self):
+        if not self.current:
+            self.position_timer = None
+            return False
+        found, position = self.player.query_position(Gst.Format.TIME)
+        known, duration = self.player.query_duration(Gst.Format.TIME)
+        self.publisher.update(
+            'paused' if self.paused else 'playing',
+            position / 1e9 if found else None,
+            duration / 1e9 if known else None,
+        )
+        return True
+
+    # _mark_finished() (private) {{{1
+    def _mark_finished(self):
+        if self.current and not skip_song_that_was_playing_when_last_killed:
+            self._mark_played(self.current)
+
+    # _mark_played() (private) {{{1
+    def _mark_played(self, song_filename):
+        self.played[song_filename] = None
+        if self.journal:
+            self.journal.record(song_filename)
+        if self.play_history:
+            self.play_history.record(song_filename)
+
+    # _song_finished() (private) {{{1
+    def _song_finished(self):
+        self._mark_finished()
+        self._play_next_song()
+
+    # _uri() (private) {{{1
+    def _uri(self, song_filename):
+        path = Path(song_filename).expanduser()
+        if self.audio_cache:
+            path = self.audio_cache.lookup(path) or path
+        if source_readahead:
+            # the song is read by the source created in _setup_source()
+            self.source_path = path
+            return "appsrc://"
+        return "file://" + str(path.resolve())
+
+    # enqueue() {{{1
+    def enqueue(self, paths, cwd='.'):
+        # Adds songs to be played after those already queued, starting them if
+        # the player is idle.  Returns the number of songs added.
+        songs = list(self._find_songs(paths, cwd))
+        self.songs += songs
+        self.enqueued.extend(songs)
+        if songs and self.player and not self.current:
+            self._play_next_song()
+        return len(songs)
+
+    # skip() {{{1
+    def skip(self):
+        if self.current:
+            timer.start('transition')
+            self.player.set_state(Gst.State.NULL)
+            self._song_finished()
+
+    # pause() {{{1
+    def pause(self):
+        if self.current:
+            self.player.set_state(Gst.State.PAUSED)
+            self.paused = True
+            self._publish_position()
+
+    # resume() {{{1
+    def resume(self):
+        if self.current:
             self.player.set_state(Gst.State.PLAYING)
-            while self.playing:
-                sleep(0.1)
-            if not skip_song_that_was_playing_when_last_killed:
-                self.played.append(song_filename)
-        self.played = []
-        sleep(1)
-        quit()
-
-    # songs_already_played() {{{1
-    def songs_already_played(self):
-        # iterate though songs already played without repeating.
-        #played = self.played
-        #seen = set()
-        #return [n for n in played if not (n in seen or seen.add(n))]
-        return list(dict.fromkeys(self.played))
+            self.paused = False
+            self._publish_position()
+
+    # status() {{{1
+    def status(self):
+        if not self.current:
+            state = 'idle'
+        elif self.paused:
+            state = 'paused'
+        else:
+            state = 'playing'
+        metadata = self.metadata
+        return dict(
+            state = state,
+            song = self.current,
+            artist = metadata.artist if metadata else None,
+            title = metadata.title if metadata else None,
+            played = len(self.played),
+            songs = len(self.songs),
+            audio_cache = (
+                self.audio_cache.statistics() if self.audio_cache else None
+            ),
+        )
+
+    # close() {{{1
+    def close(self):
+        if self.audio_cache:
+            self.audio_cache.stop()
+        if self.prefetcher:
+            # songs queued to be prefetched are dropped, the metadata of those
+            # being prefetched is read before the caches are closed, but copies
+            # into the audio cache are abandoned
+            self.prefetcher.shutdown(cancel_futures=True)
+        for reader in self.readers:
+            reader.stop()
+        self.publisher.close()
+        timer.close()
+        caches = (
+            self.metadata_cache, self.library_index, self.play_history,
+            self.audio_cache
+        )
+        for cache in caches:
+            if cache:
+                cache.close()
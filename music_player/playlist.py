@@ -0,0 +1,65 @@
+# Playlists
+#
+# Used to read and write m3u playlists.  Both read and write a line at a time,
+# or a batch of lines, so memory use does not grow with the size of the
+# playlist.
+
+# Imports {{{1
+from inform import Error, os_error
+from pathlib import Path
+
+# Globals {{{1
+batch_lines = 256
+    # number of lines read from a playlist each time it is opened
+
+# read_playlist() {{{1
+def read_playlist(path):
+    # Generates the entries in a playlist, skipping blank lines and comments,
+    # which includes extended m3u directives.  The playlist is read in batches
+    # of lines and is closed between them, so a deeply nested playlist does
+    # not hold a file open for each level.
+    offset = 0
+    while True:
+        try:
+            with path.open() as playlist:
+                playlist.seek(offset)
+                lines = [playlist.readline() for i in range(batch_lines)]
+                offset = playlist.tell()
+        except OSError as e:
+            raise Error(os_error(e))
+        for line in lines:
+            line = line.strip()
+            if line and line[0] != '#':
+                yield line
+        if not lines[-1]:
+            # readline() returns an empty string at the end of the file
+            return
+
+# write_playlist() {{{1
+def write_playlist(path, songs, cache=None):
+    # Writes the songs to a playlist.  If a metadata cache is given, an
+    # extended m3u playlist is written in which each song whose metadata is in
+    # the cache is preceded by its duration and title.  Songs whose metadata
+    # is not cached are given without them rather than being read.
+    try:
+        with path.open('w') as playlist:
+            if cache:
+                playlist.write('#EXTM3U\n')
+            for song in songs:
+                if cache:
+                    key, metadata = cache.lookup(song)
+                    if metadata:
+                        playlist.write(_extinf(song, metadata))
+                playlist.write(song + '\n')
+    except OSError as e:
+        raise Error(os_error(e))
+
+# _extinf() (private) {{{1
+def _extinf(song, metadata):
+    duration = metadata.get('duration')
+    duration = -1 if duration is None else round(duration)
+    artist = metadata.get('artist')
+    title = metadata.get('title') or Path(song).stem
+    title = f'{artist} - {title}' if artist else title
+    title = ' '.join(title.split())
+    return f'#EXTINF:{duration},{title}\n'
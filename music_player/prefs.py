@@ -1,5 +1,6 @@
 # Music Player Settings
 
+from appdirs import user_cache_dir, user_data_dir
 from pathlib import Path
 
 media_file_extensions = '.flac .mp3 .ogg .oga .wav .m4a .m4b'.lower().split()
@@ -7,8 +8,88 @@ for ext in media_file_extensions:
     assert ext[0] == '.'
 restart_path = Path('.mp-restart').expanduser()
 now_playing_path = Path('~/.nowplaying').expanduser()
+now_playing_delay = 0.25
+    # seconds to wait before writing the now playing file, so that rapid
+    # changes of song are coalesced into a single write
+now_playing_fifo = None
+    # path of a named pipe to which a JSON record of the song playing, its
+    # position and duration is written, e.g. Path('~/.nowplaying.fifo')
+now_playing_record = None
+    # path of a memory-mapped file that holds the same record, see
+    # nowplaying.py for its layout, e.g. Path('~/.nowplaying.record')
+now_playing_interval = 1
+    # seconds between updates of the position in the pipe and record
+metadata_cache_path = Path(user_data_dir('mp')) / 'metadata.db'
+    # set metadata_cache_path to None to disable the metadata cache
+library_index_path = Path(user_data_dir('mp')) / 'library.db'
+    # set library_index_path to None to disable the library index
+play_history_path = Path(user_data_dir('mp')) / 'plays.db'
+    # set play_history_path to None to disable counting plays, which are used
+    # by the weighted shuffle
+scan_threads = 16
+    # number of directories that may be listed concurrently
+index_processes = None
+    # number of processes used to read metadata with --index, None uses one
+    # per core
+index_batch_size = 64
+    # number of songs read by a process at a time with --index
+compute_replay_gain = True
+    # with --index, compute the ReplayGain of songs that do not have it in
+    # their tags; requires NumPy, and SciPy for accurate results
+replay_gain = True
+    # adjust the volume of each song by its ReplayGain, if it is known
+replay_gain_preamp = 0
+    # gain in dB added to the ReplayGain of every song
+replay_gain_max_volume = 1
+    # the largest volume used, values above 1 amplify quiet songs but may
+    # cause them to clip
+audio_cache_size = 0
+    # number of bytes of songs that are copied to local storage so they are
+    # not read again from slow storage when replayed, e.g. 4e9; 0 disables;
+    # songs are copied as they are prefetched, so prefetch_songs must not be 0
+audio_cache_path = Path(user_cache_dir('mp')) / 'audio'
+    # directory that holds the copies
+prefetch_songs = 4
+    # number of upcoming songs whose metadata is read in advance, 0 disables;
+    # the audio cache also copies songs as they are prefetched
+prefetch_threads = 2
+    # number of songs whose metadata may be read concurrently
+prefetch_readahead = True
+    # also start reading upcoming songs into the page cache
+source_readahead = 0
+    # number of bytes read at a time ahead of the decoder by a thread of its
+    # own, so playback rides out stalls of slow or network storage, e.g. 4e6;
+    # 0 leaves reading to GStreamer
+control_path = Path(user_data_dir('mp')) / 'control'
+    # the socket on which a daemon listens for commands
+control_timeout = 1
+    # maximum time in seconds the daemon waits on a client
+timing = None
+    # record the time taken by each stage of finding and playing songs, choose
+    # from 'log' (write them to the log file), 'json' (append them to
+    # timing_path as JSON lines) or 'prometheus' (keep histograms and write
+    # them to timing_path in Prometheus text format); None disables
+timing_path = None
+    # by default timing.jsonl or timing.prom in the user data directory
 separator = '### skip the following songs ###'
+restart_sync_interval = 60
+    # maximum time in seconds between syncing the restart file to disk
 skip_song_that_was_playing_when_last_killed = True
+metadata_readers = {
+    '.flac': ['flac'],
+    '.mp3': ['mp3', 'id3'],
+    '.ogg': ['oggvorbis'],
+    '.oga': ['oggvorbis', 'oggopus', 'oggflac'],
+    '.wav': ['wave'],
+    '.m4a': ['mp4'],
+    '.m4b': ['mp4'],
+}
+    # the readers tried, in order, when reading the metadata from a file with
+    # the given extension; the choices are easyid3, id3, mp3, flac, oggvorbis,
+    # oggopus, oggflac, mp4 and wave; mp3 fails on files in which it cannot
+    # find an MPEG frame, id3 then still reads their tags
+default_metadata_readers = ['easyid3', 'id3']
+    # the readers tried for files with other extensions
 show_album = True
 show_track = False
 now_playing_sep = '—'
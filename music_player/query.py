@@ -0,0 +1,102 @@
+# Queries
+#
+# Used to choose songs by their metadata rather than by path.  A query is a
+# sequence of terms, all of which must match.  Each term takes one of the
+# following forms:
+#
+#     field:value     the field contains value, ignoring case
+#     field:~regex    the field matches the regular expression, ignoring case
+#     field:=value    the field equals value
+#     field:>value    also >=, < and <=, compares the field to value
+#     value           artist, album or title contains value
+#
+# The numeric fields (year, track, volume, duration and gain) are compared as
+# numbers, and for them field:value is the same as field:=value.  Values that
+# contain spaces must be quoted.  For example:
+#
+#     mp -q 'artist:Coltrane year:>1960 album:~^love'
+#
+# Queries are translated to SQL and evaluated against the metadata cache, so
+# only songs whose metadata has been cached are found.  The regular
+# expressions are evaluated by the regexp() function the cache provides.
+
+# Imports {{{1
+from .cache import fields
+from inform import Error
+import re
+import shlex
+
+# Globals {{{1
+numeric_fields = 'year track volume duration gain'.split()
+text_numeric_fields = 'track volume'.split()
+    # numeric fields that are stored as text, such as '3/12', so they are cast
+    # to be compared; the others are compared directly, which allows their
+    # indices to be used
+default_fields = 'artist album title'.split()
+comparisons = '>= <= > < ='.split()
+    # longest first, so >= is not taken to be >
+
+# find_songs() {{{1
+def find_songs(cache, query):
+    # returns the songs in the metadata cache that match the query
+    condition, params = parse_query(query)
+    try:
+        return cache.select(condition, params)
+    except Error as e:
+        e.reraise(culprit=query)
+
+# parse_query() {{{1
+def parse_query(query):
+    # returns the SQL condition that implements the query along with its
+    # parameters
+    try:
+        terms = shlex.split(query)
+    except ValueError as e:
+        raise Error(e, culprit=query)
+    if not terms:
+        raise Error('empty query.')
+    conditions = []
+    params = []
+    for term in terms:
+        field, sep, value = term.partition(':')
+        if not sep:
+            field, value = None, term
+        elif field not in fields:
+            raise Error(
+                'unknown field, choose from:', ', '.join(fields), culprit=term
+            )
+        condition, param = _parse_term(field, value, term)
+        conditions.append(condition)
+        params += param
+    return ' and '.join(conditions), params
+
+# _parse_term() (private) {{{1
+def _parse_term(field, value, term):
+    if field is None:
+        parsed = [_parse_term(f, value, term) for f in default_fields]
+        condition = ' or '.join(condition for condition, param in parsed)
+        return f'({condition})', [p for condition, param in parsed for p in param]
+
+    if value.startswith('~'):
+        regex = value[1:]
+        try:
+            re.compile(regex)
+        except re.error as e:
+            raise Error(e, culprit=term)
+        return f'{field} regexp ?', [regex]
+
+    op = next((op for op in comparisons if value.startswith(op)), None)
+    if op:
+        value = value[len(op):]
+    if field in numeric_fields:
+        try:
+            number = float(value)
+        except ValueError:
+            raise Error('expected a number.', culprit=term)
+        if field in text_numeric_fields:
+            return f'cast({field} as real) {op or "="} ?', [number]
+        return f'{field} {op or "="} ?', [number]
+    if op:
+        return f'{field} {op} ? collate nocase', [value]
+    escaped = re.sub(r'([%_\\])', r'\\\1', value)
+    return f"{field} like ? escape '\\'", [f'%{escaped}%']
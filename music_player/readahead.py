@@ -0,0 +1,151 @@
+# ReadAhead class
+#
+# Optionally feeds songs to the player through an appsrc element in place of
+# the filesrc that playbin otherwise uses.  filesrc reads the song in small
+# blocks as the decoder asks for them, so on network filesystems the decoder
+# waits on the server for each block and a latency spike of a second or two
+# stalls the song.  Instead a thread reads the song in large chunks, well
+# ahead of the decoder, and queues them in the appsrc.  The appsrc holds up to
+# two chunks: the one being decoded and the next, which is read while the
+# first plays.  Reading resumes once less than a chunk remains, so playback
+# only stalls if reading a chunk takes longer than playing one.
+#
+# Seeks are supported: the appsrc asks for the data at the new offset, any
+# chunk being read at the time is discarded, and reading resumes from there
+# once the appsrc asks for more data.
+
+# Imports {{{1
+from inform import os_error, warn
+from threading import Condition, Thread
+import os
+
+# Globals {{{1
+block_size = 65536
+    # size of the buffers the chunks are divided into when queued
+
+# load_gst_app() {{{1
+# The GStreamer application library is only loaded if read-ahead is used.
+GstApp = None
+def load_gst_app():
+    global GstApp
+    if not GstApp:
+        import gi
+        gi.require_version('GstApp', '1.0')
+        from gi.repository import GstApp
+    return GstApp
+
+# ReadAhead class {{{1
+class ReadAhead(object):
+    def __init__(self, path, source, chunk_size, Gst):
+        self.path = path
+        self.source = source
+        self.chunk_size = chunk_size
+        self.Gst = Gst
+        self.condition = Condition()
+            # guards the state below, reentrant as the appsrc may emit
+            # enough-data while a buffer is being pushed
+        self.offset = 0
+            # position in the song of the next chunk to read
+        self.generation = 0
+            # incremented by each seek, so chunks read before it are discarded
+        self.wanted = False
+            # true while the appsrc wants more data
+        self.finished = False
+            # true once the end of the song has been reached
+        self.stopped = False
+        try:
+            self.fd = os.open(path, os.O_RDONLY)
+            size = os.fstat(self.fd).st_size
+        except OSError as e:
+            # the song ends without data, so the player reports an error
+            warn(os_error(e))
+            self.fd = None
+            source.emit('end-of-stream')
+            return
+
+        source.set_property('format', Gst.Format.BYTES)
+        source.set_property(
+            'stream-type', load_gst_app().AppStreamType.SEEKABLE
+        )
+        source.set_property('size', size)
+        source.set_property('max-bytes', 2 * chunk_size)
+        source.set_property('min-percent', 50)
+            # ask for more data once less than one chunk remains
+        source.connect('need-data', self._need_data)
+        source.connect('enough-data', self._enough_data)
+        source.connect('seek-data', self._seek_data)
+        Thread(target=self._read, daemon=True).start()
+
+    # stop() {{{2
+    def stop(self):
+        # ends the reader thread, which closes the song
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+
+    # _need_data() (private) {{{2
+    def _need_data(self, source, length):
+        with self.condition:
+            self.wanted = True
+            self.condition.notify()
+
+    # _enough_data() (private) {{{2
+    def _enough_data(self, source):
+        with self.condition:
+            self.wanted = False
+
+    # _seek_data() (private) {{{2
+    def _seek_data(self, source, offset):
+        # The appsrc discards the data it holds once this returns, so reading
+        # from the new offset waits until it next asks for data.
+        with self.condition:
+            self.offset = offset
+            self.generation += 1
+            self.wanted = False
+            self.finished = False
+        return True
+
+    # _read() (private) {{{2
+    def _read(self):
+        # runs in its own thread, so waiting on the filesystem does not hold
+        # up the decoder
+        try:
+            while True:
+                with self.condition:
+                    while not self.stopped and (
+                        not self.wanted or self.finished
+                    ):
+                        self.condition.wait()
+                    if self.stopped:
+                        return
+                    offset, generation = self.offset, self.generation
+                try:
+                    chunk = os.pread(self.fd, self.chunk_size, offset)
+                except OSError as e:
+                    warn(os_error(e))
+                    chunk = b''
+                with self.condition:
+                    if generation == self.generation and not self.stopped:
+                        self._push(chunk)
+        finally:
+            os.close(self.fd)
+
+    # _push() (private) {{{2
+    def _push(self, chunk):
+        # queues the chunk in the appsrc, or signals the end of the song if it
+        # is empty; must be called with the condition held
+        Gst = self.Gst
+        if not chunk:
+            self.finished = True
+            self.source.emit('end-of-stream')
+            return
+        self.offset += len(chunk)
+        view = memoryview(chunk)
+        for start in range(0, len(chunk), block_size):
+            block = bytes(view[start:start + block_size])
+            buffer = Gst.Buffer.new_wrapped(block)
+            if self.source.emit('push-buffer', buffer) != Gst.FlowReturn.OK:
+                # the appsrc is flushing or shutting down, wait until it asks
+                # for data again
+                self.wanted = False
+                return
@@ -0,0 +1,133 @@
+# Shuffle
+#
+# Strategies used to shuffle the play order of a song list.  Each takes a
+# random number generator, so a seeded generator reproduces the same order.
+#
+#     songs     each song is placed independently (Fisher-Yates)
+#     artist    the songs of each artist are spread evenly through the list,
+#               so the same artist is rarely heard twice in a row
+#     album     albums are played whole, in track order, with the albums in
+#               random order
+#     weighted  songs that have been played less often tend to come first
+#
+# The artist and album of a song are taken from the metadata cache when they
+# are available.  Otherwise the layout of the library is assumed to be
+# artist/album/song, so the directory that contains the song stands in for
+# its album and the directory above that for its artist.  Likewise the songs
+# of an album are ordered by their disc and track numbers when cached, and
+# otherwise by file name.  All strategies run in linear time, other than
+# album, artist and weighted, which sort the songs once.
+
+# Imports {{{1
+from collections import defaultdict
+from inform import Error
+from math import log
+import os
+import re
+
+# shuffle() {{{1
+def shuffle(songs, mode, rng, cache=None, history=None):
+    if mode not in shuffle_modes:
+        raise Error(
+            'unknown shuffle mode, choose from:', ', '.join(shuffle_modes),
+            culprit=mode
+        )
+    if mode == 'songs':
+        songs.shuffle(rng)
+    else:
+        songs.reorder(shuffle_modes[mode](songs, rng, cache, history))
+
+# _by_artist() (private) {{{1
+def _by_artist(songs, rng, cache, history):
+    # Each artist's songs are shuffled and given evenly spaced positions in
+    # the unit interval, starting from a random offset and with a little
+    # jitter, then the songs of all artists are merged by position.
+    directories, tagged = _tagged(songs, _cached(cache, 'artist'))
+    parents = [os.path.dirname(d) for d in directories]
+    groups = defaultdict(list)
+    for n, d, artist in tagged:
+        groups[artist.casefold() if artist else parents[d]].append(n)
+    positioned = []
+    for members in groups.values():
+        rng.shuffle(members)
+        spacing = 1 / len(members)
+        position = rng.random() * spacing
+        for n in members:
+            jitter = rng.uniform(-0.1, 0.1) * spacing
+            positioned.append((position + jitter, n))
+            position += spacing
+    positioned.sort()
+    return (n for position, n in positioned)
+
+# _by_album() (private) {{{1
+def _by_album(songs, rng, cache, history):
+    directories, tagged = _tagged(songs, _cached(cache, 'album'))
+    volumes = _cached(cache, 'volume')
+    tracks = _cached(cache, 'track')
+    groups = {}
+    for n, d, album in tagged:
+        name = songs.name(n)
+        if volumes or tracks:
+            path = os.path.join(directories[d], name)
+            position = (
+                _number(volumes.get(path)), _number(tracks.get(path)), name
+            )
+        else:
+            position = (0, 0, name)
+        groups.setdefault((d, album), []).append((position, n))
+    groups = list(groups.values())
+    rng.shuffle(groups)
+    for members in groups:
+        members.sort()
+    return (n for members in groups for position, n in members)
+
+# _by_play_count() (private) {{{1
+def _by_play_count(songs, rng, cache, history):
+    # Weighted random sampling without replacement (Efraimidis and Spirakis):
+    # each song is given the key u^(1/w), where u is uniform on (0, 1] and w
+    # is its weight, and the songs are sorted by key.  The logarithm of the
+    # key is used as it is better behaved numerically.  A song's weight is
+    # 1/(1 + the number of times it was played).
+    directories, tagged = _tagged(songs, history.counts() if history else {})
+    keyed = [
+        (log(1 - rng.random()) * (1 + (count or 0)), n)
+        for n, d, count in tagged
+    ]
+    keyed.sort(reverse=True)
+    return (n for key, n in keyed)
+
+# _tagged() (private) {{{1
+def _tagged(songs, values):
+    # Returns the absolute paths of the song directories along with a
+    # generator that gives the number, directory index and value of each
+    # song, in play order.  The values are looked up by absolute path and are
+    # None for songs not given one.  Paths are only built if there are values
+    # to look up, as building them dominates the time taken otherwise.
+    directories = [os.path.abspath(d) for d in songs.directories]
+    def generate():
+        if values:
+            for n, d in songs.numbered():
+                path = os.path.join(directories[d], songs.name(n))
+                yield n, d, values.get(path)
+        else:
+            for n, d in songs.numbered():
+                yield n, d, None
+    return directories, generate()
+
+# _number() (private) {{{1
+def _number(value):
+    # the leading number of a track or disc number such as '3/12', 0 if none
+    match = re.match(r'\s*(\d+)', str(value or ''))
+    return int(match.group(1)) if match else 0
+
+# _cached() (private) {{{1
+def _cached(cache, field):
+    return cache.values(field) if cache else {}
+
+# Globals {{{1
+shuffle_modes = dict(
+    songs = None,
+    artist = _by_artist,
+    album = _by_album,
+    weighted = _by_play_count,
+)
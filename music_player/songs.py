@@ -0,0 +1,98 @@
+# SongList class
+#
+# A compact list of song paths.  Libraries of a million songs are common and
+# a list of full path strings is dominated by the repeated directory names.
+# Instead, each directory is stored once and each song is stored as the index
+# of its directory along with its file name, packed into a shared buffer.
+
+# Imports {{{1
+from array import array
+import os
+import random
+
+# SongList class {{{1
+class SongList(object):
+    def __init__(self, songs=()):
+        self.directories = []
+        self.directory_indices = {}
+        self.names = bytearray()
+        # per song arrays, indexed by song number; the name of a song runs
+        # from its offset to the offset of the next song
+        self.directory = array('I')
+        self.offset = array('I')
+        # the songs in play order, as song numbers
+        self.order = array('I')
+        self.extend(songs)
+
+    # append() {{{2
+    def append(self, song):
+        directory, name = os.path.split(song)
+        index = self.directory_indices.get(directory)
+        if index is None:
+            index = len(self.directories)
+            self.directories.append(directory)
+            self.directory_indices[directory] = index
+        offset = len(self.names)
+        if offset > 0xffffffff and self.offset.typecode == 'I':
+            self.offset = array('Q', self.offset)
+        self.order.append(len(self.directory))
+        self.directory.append(index)
+        self.offset.append(offset)
+        self.names += os.fsencode(name)
+
+    # extend() {{{2
+    def extend(self, songs):
+        for song in songs:
+            self.append(song)
+
+    def __iadd__(self, songs):
+        self.extend(songs)
+        return self
+
+    # shuffle() {{{2
+    def shuffle(self, rng=random):
+        # Fisher-Yates shuffle of the play order, done in place so that no
+        # temporary list of the songs is needed
+        order = self.order
+        randbelow = rng.randrange
+        for i in range(len(order) - 1, 0, -1):
+            j = randbelow(i + 1)
+            order[i], order[j] = order[j], order[i]
+
+    # numbered() {{{2
+    def numbered(self):
+        # generates the song number and directory index of each song, in play
+        # order
+        directory = self.directory
+        for n in self.order:
+            yield n, directory[n]
+
+    # reorder() {{{2
+    def reorder(self, numbers):
+        # replaces the play order with the given song numbers
+        order = array('I', numbers)
+        assert len(order) == len(self.order)
+        self.order = order
+
+    # name() {{{2
+    def name(self, n):
+        # returns the file name of song number n
+        start = self.offset[n]
+        end = self.offset[n+1] if n + 1 < len(self.offset) else len(self.names)
+        return os.fsdecode(bytes(self.names[start:end]))
+
+    # _song() (private) {{{2
+    def _song(self, n):
+        return os.path.join(self.directories[self.directory[n]], self.name(n))
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._song(n) for n in self.order[i]]
+        return self._song(self.order[i])
+
+    def __iter__(self):
+        for n in self.order:
+            yield self._song(n)
+
+    def __len__(self):
+        return len(self.order)
@@ -0,0 +1,162 @@
+# Timer class
+#
+# Optionally records the time taken by each stage of finding and playing
+# songs: scanning, reading metadata, setting the URI, prerolling the pipeline,
+# and the transition from the end of one song to the start of the next.  It is
+# enabled by the timing setting in prefs.py, and the results are either
+# written to the log file, appended to a file as JSON lines, or kept as
+# histograms that are written to a file in the Prometheus text format, as
+# expected by the node exporter textfile collector.
+#
+# A single timer, timer, is shared by the player and the metadata readers.
+# When disabled, each of its methods returns immediately.
+
+# Imports {{{1
+from .nowplaying import write_atomically
+from .prefs import timing, timing_path
+from appdirs import user_data_dir
+from contextlib import contextmanager
+from inform import log, os_error, warn
+from pathlib import Path
+from threading import Lock
+from time import monotonic, perf_counter, time
+import json
+
+# Globals {{{1
+outputs = 'log json prometheus'.split()
+buckets = [
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+]
+    # upper bounds of the histogram buckets, in seconds
+prometheus_interval = 1
+    # minimum time in seconds between writes of the Prometheus file
+
+# Timer class {{{1
+class Timer(object):
+    def __init__(self, output=None, path=None):
+        if output and output not in outputs:
+            warn(
+                'unknown timing output, choose from:', ', '.join(outputs),
+                culprit=output
+            )
+            output = None
+        self.output = output
+        self.enabled = bool(output)
+        if not path:
+            suffix = '.prom' if output == 'prometheus' else '.jsonl'
+            path = Path(user_data_dir('mp')) / f'timing{suffix}'
+        self.path = Path(path).expanduser()
+            # the path is given in the settings, where it may be a string and
+            # may start with ~
+        self.lock = Lock()
+        self.started = {}
+            # the start times of the stages being timed with start() and stop()
+        self.histograms = {}
+            # stage -> (bucket counts, sum, count)
+        self.file = None
+        self.last_written = 0
+
+    # start() {{{2
+    def start(self, stage):
+        if self.enabled:
+            self.started[stage] = perf_counter()
+
+    # stop() {{{2
+    def stop(self, stage, song=None):
+        # records the time since the stage was started, if it was
+        if self.enabled:
+            started = self.started.pop(stage, None)
+            if started is not None:
+                self.record(stage, perf_counter() - started, song)
+
+    # measure() {{{2
+    @contextmanager
+    def measure(self, stage, song=None):
+        # records the time taken by the body of a with statement
+        if not self.enabled:
+            yield
+            return
+        started = perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, perf_counter() - started, song)
+
+    # record() {{{2
+    def record(self, stage, seconds, song=None):
+        with self.lock:
+            if self.output == 'log':
+                log(f'{stage}: {1000 * seconds:.2f} ms', culprit=song)
+            elif self.output == 'json':
+                self._write_json(stage, seconds, song)
+            else:
+                self._add_to_histogram(stage, seconds)
+                if monotonic() - self.last_written >= prometheus_interval:
+                    self._write_prometheus()
+
+    # close() {{{2
+    def close(self):
+        with self.lock:
+            if self.output == 'prometheus' and self.histograms:
+                self._write_prometheus()
+            if self.file:
+                self.file.close()
+                self.file = None
+
+    # _write_json() (private) {{{2
+    def _write_json(self, stage, seconds, song):
+        try:
+            if not self.file:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self.file = self.path.open('a')
+            self.file.write(json.dumps(dict(
+                stage = stage,
+                seconds = round(seconds, 6),
+                song = song and str(song),
+                time = round(time(), 3),
+            )) + '\n')
+            self.file.flush()
+        except OSError as e:
+            self._disable(e)
+
+    # _add_to_histogram() (private) {{{2
+    def _add_to_histogram(self, stage, seconds):
+        counts, total, count = self.histograms.get(
+            stage, ([0] * len(buckets), 0, 0)
+        )
+        for i, bound in enumerate(buckets):
+            if seconds <= bound:
+                counts[i] += 1
+        self.histograms[stage] = (counts, total + seconds, count + 1)
+
+    # _write_prometheus() (private) {{{2
+    def _write_prometheus(self):
+        lines = [
+            '# HELP mp_stage_seconds Time taken by each stage of playing songs.',
+            '# TYPE mp_stage_seconds histogram',
+        ]
+        for stage, (counts, total, count) in sorted(self.histograms.items()):
+            for bound, n in zip(buckets, counts):
+                lines.append(
+                    f'mp_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {n}'
+                )
+            lines += [
+                f'mp_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {count}',
+                f'mp_stage_seconds_sum{{stage="{stage}"}} {total:.6f}',
+                f'mp_stage_seconds_count{{stage="{stage}"}} {count}',
+            ]
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            write_atomically(self.path, '\n'.join(lines) + '\n')
+        except OSError as e:
+            self._disable(e)
+        self.last_written = monotonic()
+
+    # _disable() (private) {{{2
+    def _disable(self, e):
+        warn('timing disabled:', os_error(e))
+        self.enabled = False
+        self.output = None
+
+# timer {{{1
+timer = Timer(timing, timing_path)
@@ -37,7 +37,7 @@ setup(
         'mutagen',
         'pygobject',
     ],
-    python_requires = '>=3.6',
+    python_requires = '>=3.9',
 )
 
 print(message)